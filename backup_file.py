@@ -0,0 +1,35 @@
+import json
+
+
+# Reads the playlists of a backup written by spotify-backup.py, in either its JSON or
+# its NDJSON format.
+def load_playlists(json_file):
+    if json_file.endswith((".ndjson", ".jsonl")):
+        return NDJSONPlaylists(json_file)
+    with open(json_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["playlists"]
+
+
+class NDJSONPlaylists:
+    # The playlists of an NDJSON backup written by spotify-backup.py --format=ndjson. The
+    # file is read again every time this is iterated, and only one playlist at a time is
+    # held in memory.
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        playlist = None
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                kind = record.pop("type", None)
+                if kind == "playlist":
+                    if playlist is not None:
+                        yield playlist
+                    playlist = record
+                    playlist["tracks"] = []
+                elif kind == "track":
+                    playlist["tracks"].append(record)
+        if playlist is not None:
+            yield playlist
@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import ytmusic_add
+from backup_file import load_playlists
+from journal import MigrationJournal
+from metrics import Metrics
+from ratelimit import Retrier, TokenBucket
+from search_cache import (
+    CachedYTMusic,
+    SearchCache,
+    DEFAULT_CACHE_FILE,
+    DEFAULT_TTL_DAYS,
+    DEFAULT_MAX_ENTRIES,
+)
+
+# Migrates the libraries of several accounts in one job, like ytmusic_add.py --auto-add
+# for each of them. The manifest is a JSON list with one entry per account:
+#
+#   [{"name": "alice", "file": "alice.json", "auth": "alice_browser.json", "rate": 5}]
+#
+# "name" defaults to the backup file's name and "rate" to --rate. All accounts share one
+# pool of search workers, taking turns, and one search cache; each has its own rate
+# limit and journal (migration_journal.<name>.jsonl, or "journal"), so an interrupted
+# job continues with --resume.
+#
+#   python batch_migrate.py accounts.json --workers 16 --accounts 4
+
+
+class FairScheduler:
+    # Runs the tasks of several accounts on one pool of worker threads. Accounts with
+    # tasks waiting take turns, and no account runs more than per_account tasks at once,
+    # so one account with a huge library or a low rate limit can't hold up the others.
+    def __init__(self, workers, per_account):
+        self.per_account = per_account
+        self._queues = {}
+        self._running = {}
+        # Accounts with tasks waiting, in the order they get their next turn.
+        self._turns = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # Returns an executor that submits to this scheduler as the given account, for use
+    # with ytmusic_add.ordered_map.
+    def executor(self, account):
+        return _AccountExecutor(self, account)
+
+    def submit(self, account, fn, *args, **kwargs):
+        future = Future()
+        with self._cond:
+            queue = self._queues.setdefault(account, deque())
+            if not queue:
+                self._turns.append(account)
+            queue.append((future, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    # Takes the next task of the first account in turn that isn't at its limit.
+    def _next(self):
+        for _ in range(len(self._turns)):
+            account = self._turns.popleft()
+            if self._running.get(account, 0) >= self.per_account:
+                self._turns.append(account)
+                continue
+            queue = self._queues[account]
+            task = queue.popleft()
+            if queue:
+                self._turns.append(account)
+            self._running[account] = self._running.get(account, 0) + 1
+            return account, task
+        return None, None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                account, task = self._next()
+                while task is None:
+                    if self._closed and not self._turns:
+                        return
+                    self._cond.wait()
+                    account, task = self._next()
+
+            future, fn, args, kwargs = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self._cond:
+                self._running[account] -= 1
+                self._cond.notify_all()
+
+
+class _AccountExecutor:
+    def __init__(self, scheduler, account):
+        self._scheduler = scheduler
+        self._account = account
+
+    def submit(self, fn, *args, **kwargs):
+        return self._scheduler.submit(self._account, fn, *args, **kwargs)
+
+
+def load_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        accounts = json.load(f)
+    for account in accounts:
+        account.setdefault("name", os.path.splitext(os.path.basename(account["file"]))[0])
+    names = [account["name"] for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path}: account names must be unique")
+    return accounts
+
+
+# Migrates one account's playlists and returns a summary for the report. Searches go
+# through the scheduler; creating playlists and adding songs happens on the calling
+# thread.
+def migrate_account(account, scheduler, cache, args):
+    name = account["name"]
+    print(f"\n👤 [{name}] Migrating {account['file']}")
+    metrics = Metrics()
+    limiter = TokenBucket(account.get("rate", args.rate), burst=args.per_account)
+    ytmusic = ytmusic_add.RetryingYTMusic(
+        ytmusic_add.LazyYTMusic(account["auth"]), Retrier(limiter=limiter, metrics=metrics)
+    )
+    if cache:
+        ytmusic = CachedYTMusic(ytmusic, cache)
+    playlists = load_playlists(account["file"])
+    journal = MigrationJournal(
+        account.get("journal") or f"migration_journal.{name}.jsonl", resume=args.resume
+    )
+    # migrate_playlist takes its settings from ytmusic_add.py's command line.
+    options = argparse.Namespace(
+        add=False, tiered_search=args.tiered_search, batch_size=args.batch_size
+    )
+
+    def pending():
+        return (p for p in playlists if not journal.is_done(ytmusic_add.playlist_key(p)))
+
+    try:
+        known = {
+            key: [choice] if choice else [] for key, choice in journal.choices.items()
+        }
+        with metrics.phase("search"):
+            resolved = ytmusic_add.resolve_unique_tracks(
+                ytmusic,
+                pending(),
+                args.per_account,
+                known,
+                args.tiered_search,
+                pool=scheduler.executor(name),
+            )
+        with metrics.phase("playlists"):
+            for playlist in pending():
+                ytmusic_add.migrate_playlist(ytmusic, playlist, options, resolved, journal)
+    finally:
+        journal.close()
+
+    matched = sum(1 for results in resolved.values() if results)
+    print(f"\n👤 [{name}] Done: {matched}/{len(resolved)} tracks matched")
+    return metrics.report(
+        account=name, tracks={"unique": len(resolved), "matched": matched}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrate the Spotify backups of several accounts to YouTube Music."
+    )
+    parser.add_argument("manifest", help="JSON file listing the accounts to migrate")
+    parser.add_argument(
+        "--accounts",
+        type=int,
+        default=4,
+        help="number of accounts migrated at the same time (default: 4)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="number of searches running at once, shared by all accounts (default: 8)",
+    )
+    parser.add_argument(
+        "--per-account",
+        type=int,
+        default=2,
+        help="maximum number of searches running at once for one account (default: 2)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=5.0,
+        help="searches per second per account, unless its manifest entry has a "
+        "\"rate\" (default: 5)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=ytmusic_add.ADD_BATCH_SIZE,
+        help=f"songs added to a playlist per request (default: {ytmusic_add.ADD_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--tiered-search",
+        type=float,
+        nargs="?",
+        const=ytmusic_add.TIERED_SEARCH_CONFIDENCE,
+        metavar="SCORE",
+        help="only search videos when no song result scores at least SCORE",
+    )
+    parser.add_argument(
+        "--cache",
+        default=DEFAULT_CACHE_FILE,
+        help=f"search cache shared by all accounts (default: {DEFAULT_CACHE_FILE})",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="don't use the search cache")
+    parser.add_argument(
+        "--resume", action="store_true", help="continue an interrupted job from its journals"
+    )
+    parser.add_argument("--report", metavar="FILE", help="write a JSON report of the job")
+    args = parser.parse_args()
+
+    accounts = load_manifest(args.manifest)
+    cache = None
+    if not args.no_cache:
+        cache = SearchCache(
+            args.cache, ttl=DEFAULT_TTL_DAYS * 86400, max_entries=DEFAULT_MAX_ENTRIES
+        )
+    scheduler = FairScheduler(args.workers, args.per_account)
+
+    pool = ThreadPoolExecutor(args.accounts)
+    futures = {
+        account["name"]: pool.submit(migrate_account, account, scheduler, cache, args)
+        for account in accounts
+    }
+    reports = {}
+    failed = []
+    try:
+        for name, future in futures.items():
+            try:
+                reports[name] = future.result()
+            except Exception as e:
+                print(f"❌ [{name}] Failed: {e}")
+                failed.append(name)
+    except KeyboardInterrupt:
+        # The journals and the cache are written as the job goes, so nothing is lost by
+        # stopping the account threads right away instead of waiting for them.
+        print("\n⏹ Interrupted. Run again with --resume to continue.")
+        os._exit(1)
+    pool.shutdown()
+    scheduler.close()
+    if cache:
+        print(f"\n🗄 Search cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+
+    print(f"\n✅ Migrated {len(reports)}/{len(accounts)} accounts")
+    if failed:
+        print(f"❌ Failed: {', '.join(failed)}. Run again with --resume to retry them.")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "accounts": reports,
+                    "failed": failed,
+                    "cache": {"hits": cache.hits, "misses": cache.misses} if cache else None,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,529 @@
+import argparse
+import collections
+import contextlib
+import gzip
+import http.server
+import importlib.util
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+import ytmusic_add
+from ratelimit import Retrier, TokenBucket
+from search_cache import CachedYTMusic, SearchCache
+
+# Runs the real search, auto-add, insert and Spotify paging code against local stand-ins
+# for YouTube Music and the Spotify Web API, and reports how fast each one goes.
+#
+#   python benchmark.py --tracks 10000 --latency 0.05 --workers 8
+
+
+# spotify-backup.py can't be imported by name because of the dash.
+def load_spotify_backup():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spotify-backup.py")
+    spec = importlib.util.spec_from_file_location("spotify_backup", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Builds playlists in the shape of a full Spotify backup. Only unique_ratio of the
+# tracks are distinct; the rest are repeats, like songs saved in several playlists.
+def synthetic_library(tracks, playlists, unique_ratio=0.4, seed=0):
+    rng = random.Random(seed)
+    unique = max(1, int(tracks * unique_ratio))
+    pool = [
+        {
+            "uri": f"spotify:track:{i:022d}",
+            "id": f"{i:022d}",
+            "name": f"Song {i} {rng.choice(['Love', 'Night', 'Fire', 'Rain', 'Home'])}",
+            "artists": [{"name": f"Artist {i % 997}"}],
+            "album": {"name": f"Album {i % 3001}", "release_date": "2020-01-01"},
+            "duration_ms": rng.randint(120, 360) * 1000,
+            "external_ids": {"isrc": f"USXXX{i:07d}"},
+            "available_markets": ["US", "GB", "DE", "FR", "SE"] * 10,
+        }
+        for i in range(unique)
+    ]
+    library = []
+    for p in range(playlists):
+        count = tracks // playlists + (1 if p < tracks % playlists else 0)
+        items = [
+            {
+                "added_at": "2024-01-01T00:00:00Z",
+                "is_local": False,
+                "track": pool[i if p == 0 and i < unique else rng.randrange(unique)],
+            }
+            for i in range(count)
+        ]
+        library.append(
+            {
+                "id": f"playlist{p}",
+                "name": f"Playlist {p}",
+                "description": "",
+                "snapshot_id": "snapshot1",
+                "tracks": items,
+            }
+        )
+    return library
+
+
+class FakeYTMusic:
+    # Stands in for ytmusicapi.YTMusic. Every call sleeps for `latency` seconds and fails
+    # with probability error_rate, half the time with a throttling error.
+    def __init__(self, latency=0.05, error_rate=0.0, results=20, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.results = results
+        self.requests = collections.Counter()
+        self.playlists = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.requests[name] += 1
+            roll = self._rng.random()
+        time.sleep(self.latency)
+        if roll < self.error_rate / 2:
+            raise Exception("Server returned HTTP 429: Too Many Requests.")
+        if roll < self.error_rate:
+            raise Exception("Server returned HTTP 500: Internal Server Error.")
+
+    def search(self, query, filter=None, **kwargs):
+        self._call("search")
+        words = query.split()
+        return [
+            {
+                "resultType": "song" if filter == "songs" else "video",
+                "title": " ".join(words[: max(1, len(words) - i % 3)]),
+                "artists": [{"name": words[-1] if i % 2 == 0 else f"Someone {i}"}],
+                "album": {"name": "Fake Album"} if filter == "songs" else None,
+                "videoId": f"{abs(hash((query, filter, i))) % 10**11:011d}",
+                "duration": "3:00",
+                "duration_seconds": 180 + i,
+            }
+            for i in range(self.results)
+        ]
+
+    def create_playlist(self, title, description, privacy_status="PRIVATE", **kwargs):
+        self._call("create_playlist")
+        with self._lock:
+            playlist_id = f"PL{len(self.playlists):08d}"
+            self.playlists[playlist_id] = []
+        return playlist_id
+
+    def add_playlist_items(self, playlistId, videoIds=None, **kwargs):
+        self._call("add_playlist_items")
+        with self._lock:
+            self.playlists[playlistId] += [
+                {"videoId": v, "setVideoId": f"set{v}"} for v in videoIds
+            ]
+        return {"status": "STATUS_SUCCEEDED", "playlistEditResults": []}
+
+    def get_playlist(self, playlistId, limit=100, **kwargs):
+        self._call("get_playlist")
+        tracks = self.playlists.get(playlistId, [])
+        return {"id": playlistId, "trackCount": len(tracks), "tracks": list(tracks)}
+
+    def remove_playlist_items(self, playlistId, videos):
+        self._call("remove_playlist_items")
+        removed = {v["setVideoId"] for v in videos}
+        with self._lock:
+            self.playlists[playlistId] = [
+                t for t in self.playlists[playlistId] if t["setVideoId"] not in removed
+            ]
+        return "STATUS_SUCCEEDED"
+
+
+class FakeSpotifyServer(http.server.ThreadingHTTPServer):
+    # A local HTTP server answering the /v1/ endpoints spotify-backup.py uses, with the
+    # same paging (offset, limit, total, next) as the real API. Responses are gzipped
+    # when asked for and connections are kept alive. Requests fail with a 429 and
+    # Retry-After: 0 with probability error_rate.
+    daemon_threads = True
+
+    def __init__(self, library, latency=0.02, error_rate=0.0):
+        super().__init__(("127.0.0.1", 0), _FakeSpotifyHandler)
+        self.library = library
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = collections.Counter()
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    def page(self, path, query):
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 20))
+        if path == "me":
+            return {"id": "benchmark", "display_name": "Benchmark"}
+        if path == "me/tracks":
+            items = self.library[0]["tracks"] if self.library else []
+        elif path == "me/albums":
+            items = []
+        elif path.startswith("users/"):
+            items = [
+                {
+                    **{k: v for k, v in p.items() if k != "tracks"},
+                    "tracks": {
+                        "href": f"{self.url}playlists/{p['id']}/tracks",
+                        "total": len(p["tracks"]),
+                    },
+                }
+                for p in self.library
+            ]
+        elif path.startswith("playlists/"):
+            playlist_id = path.split("/")[1]
+            items = next(p for p in self.library if p["id"] == playlist_id)["tracks"]
+        else:
+            return None
+
+        following = None
+        if offset + limit < len(items):
+            following = f"{self.url}{path}?" + urllib.parse.urlencode(
+                {"offset": offset + limit, "limit": limit}
+            )
+        return {
+            "href": f"{self.url}{path}",
+            "items": items[offset : offset + limit],
+            "limit": limit,
+            "offset": offset,
+            "total": len(items),
+            "next": following,
+        }
+
+
+class _FakeSpotifyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server._lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        parts = urllib.parse.urlsplit(self.path)
+        path = parts.path[len("/v1/") :]
+        with server._lock:
+            segments = path.split("/")
+            server.requests["/".join({segments[0]: None, segments[-1]: None})] += 1
+            failed = server._rng.random() < server.error_rate
+        time.sleep(server.latency)
+
+        if failed:
+            self._send(429, b"{}", {"Retry-After": "0"})
+            return
+        data = server.page(path, dict(urllib.parse.parse_qsl(parts.query)))
+        if data is None:
+            self._send(404, b"{}")
+            return
+        body = json.dumps(data).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        self._send(200, body, headers)
+
+    def _send(self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def client(fake, args):
+    limiter = TokenBucket(args.rate, burst=max(2, args.workers))
+    return ytmusic_add.RetryingYTMusic(fake, Retrier(base_delay=0.01, limiter=limiter))
+
+
+def bench_search(library, args):
+    fake = FakeYTMusic(args.latency, args.error_rate)
+    ytmusic = client(fake, args)
+    tracks = {
+        item["track"]["uri"]: item["track"]
+        for playlist in library
+        for item in playlist["tracks"]
+    }
+    songs = [
+        ytmusic_add.spotify_track_to_song(track)
+        for track in list(tracks.values())[: args.search_tracks]
+    ]
+    list(
+        ytmusic_add.ordered_map(
+            lambda song: ytmusic_add.search_song(ytmusic, song), songs, args.workers
+        )
+    )
+    return len(songs), fake.requests
+
+
+def bench_auto_add(library, args):
+    fake = FakeYTMusic(args.latency, args.error_rate)
+    ytmusic = client(fake, args)
+    resolved = ytmusic_add.resolve_unique_tracks(ytmusic, library, args.workers)
+    tracks = 0
+    for playlist in library:
+        ytmusic_add.auto_add_tracks(ytmusic, playlist["tracks"], resolved=resolved)
+        tracks += len(playlist["tracks"])
+    return tracks, fake.requests
+
+
+def bench_add_songs(library, args):
+    fake = FakeYTMusic(args.latency, args.error_rate)
+    ytmusic = client(fake, args)
+    tracks = 0
+    for playlist in library:
+        video_ids = [f"{i:011d}" for i in range(len(playlist["tracks"]))]
+        playlist_id = ytmusic.create_playlist(playlist["name"], "")
+        ytmusic_add.add_songs(ytmusic, playlist_id, video_ids, args.batch_size)
+        tracks += len(video_ids)
+    return tracks, fake.requests
+
+
+# Runs a whole backup the way spotify-backup.py does, from listing the playlists to
+# writing them in --format, with the output thrown away.
+def bench_spotify_list(library, args):
+    spotify_backup = load_spotify_backup()
+    tracks = 0
+
+    def counted(playlists):
+        def each(items):
+            nonlocal tracks
+            for item in items:
+                tracks += 1
+                yield item
+
+        for playlist in playlists:
+            yield dict(playlist, tracks=each(playlist["tracks"]))
+
+    with FakeSpotifyServer(library, args.latency, args.error_rate) as server:
+        spotify = spotify_backup.SpotifyAPI("token", args.workers, api_url=server.url)
+        me = spotify.get("me")
+        playlists = spotify_backup.backup_playlists(
+            spotify, me, "playlists", args.slim, {}, args.workers
+        )
+        with open(os.devnull, "w", encoding="utf-8") as f:
+            spotify_backup.WRITERS[args.format](
+                f, counted(playlists), spotify_backup.liked_albums(spotify, "playlists")
+            )
+        requests = collections.Counter(server.requests)
+        requests["connections"] = server.connections
+    return tracks, requests
+
+
+# Command lines of ytmusic_add.py timed by --startup. None of them should need to import
+# ytmusicapi or log in: they are run with an auth file that doesn't exist.
+STARTUP_COMMANDS = {
+    "help": ["--help"],
+    "invalid_arguments": ["--file", "{file}"],
+    "cached_dry_run": ["--dry-run", "--file", "{file}", "--cache", "{cache}", "--no-matches"],
+}
+STARTUP_TARGET_SECONDS = 0.2
+STARTUP_TRACKS = 50
+
+
+# Runs each of STARTUP_COMMANDS a few times in a fresh interpreter and returns their
+# median wall clock times. The dry run reads a small backup whose searches are all in
+# the cache already, as they would be after an earlier run, so that it mostly measures
+# what every run costs before the real work starts.
+def measure_startup(args):
+    library = synthetic_library(STARTUP_TRACKS, 2)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ytmusic_add.py")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {
+            "file": os.path.join(tmp, "playlists.json"),
+            "cache": os.path.join(tmp, "search_cache.sqlite"),
+        }
+        with open(paths["file"], "w", encoding="utf-8") as f:
+            json.dump({"playlists": library}, f)
+        cache = SearchCache(paths["cache"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            ytmusic_add.resolve_unique_tracks(
+                CachedYTMusic(FakeYTMusic(latency=0), cache), library, args.workers
+            )
+        cache.close()
+
+        for name, argv in STARTUP_COMMANDS.items():
+            command = [sys.executable, script, "--auth", os.path.join(tmp, "missing.json")]
+            command += [arg.format(**paths) for arg in argv]
+            times = []
+            for _ in range(args.startup_runs):
+                start = time.perf_counter()
+                process = subprocess.run(command, cwd=tmp, capture_output=True, text=True)
+                times.append(time.perf_counter() - start)
+            # Argument errors exit with 2, but nothing should crash.
+            if process.returncode not in (0, 2):
+                raise RuntimeError(f"{name} failed:\n{process.stderr}")
+            results[name] = round(statistics.median(times), 3)
+    return results
+
+
+BENCHMARKS = {
+    "search": bench_search,
+    "auto_add": bench_auto_add,
+    "add_songs": bench_add_songs,
+    "spotify_list": bench_spotify_list,
+}
+
+
+def run(name, library, args):
+    if args.memory:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    # The code under test reports progress on stdout and in INFO logs, which would swamp
+    # the results. Retry warnings still get through.
+    logging.disable(logging.INFO)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            tracks, requests = BENCHMARKS[name](library, args)
+    finally:
+        logging.disable(logging.NOTSET)
+    seconds = time.perf_counter() - start
+    result = {
+        "benchmark": name,
+        "tracks": tracks,
+        "seconds": round(seconds, 3),
+        "tracks_per_second": round(tracks / seconds, 1) if seconds else None,
+        "requests": dict(requests),
+    }
+    if args.memory:
+        result["peak_memory_mb"] = round(
+            (tracemalloc.get_traced_memory()[1] - before) / 2**20, 1
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the migration code paths against local fake services."
+    )
+    parser.add_argument("--tracks", type=int, default=1000, help="total tracks (default: 1000)")
+    parser.add_argument("--playlists", type=int, default=20, help="playlists (default: 20)")
+    parser.add_argument(
+        "--unique-ratio",
+        type=float,
+        default=0.4,
+        help="share of distinct tracks in the library (default: 0.4)",
+    )
+    parser.add_argument(
+        "--search-tracks",
+        type=int,
+        default=200,
+        help="tracks searched by the search benchmark (default: 200)",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds per fake request (default: 0.02)"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of fake requests that fail (default: 0)",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="workers (default: 1)")
+    parser.add_argument(
+        "--rate", type=float, default=1000.0, help="searches per second (default: 1000)"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=ytmusic_add.ADD_BATCH_SIZE, help="insert batch size"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "ndjson", "txt"],
+        default="json",
+        help="backup format written by spotify_list (default: json)",
+    )
+    parser.add_argument(
+        "--slim", action="store_true", help="back up slim tracks in spotify_list"
+    )
+    parser.add_argument(
+        "--only",
+        default=",".join(BENCHMARKS),
+        help=f"comma separated benchmarks to run (default: {','.join(BENCHMARKS)})",
+    )
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="don't trace peak memory (tracing slows the benchmarks down)",
+    )
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="measure how long ytmusic_add.py takes to start instead (--help, an "
+        "argument error and a dry run with everything cached)",
+    )
+    parser.add_argument(
+        "--startup-runs",
+        type=int,
+        default=5,
+        help="times each command is run by --startup (default: 5)",
+    )
+    parser.add_argument("--report", help="also write the results to this JSON file")
+    args = parser.parse_args()
+    if args.slim and args.format == "txt":
+        parser.error("--slim can only be used with --format=json or --format=ndjson")
+
+    if args.startup:
+        results = measure_startup(args)
+        for name, seconds in results.items():
+            verdict = "ok" if seconds <= STARTUP_TARGET_SECONDS else "over target"
+            print(f"{name:>17}: {seconds:.3f}s ({verdict}, target {STARTUP_TARGET_SECONDS}s)")
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump({"settings": vars(args), "startup": results}, f, indent=2)
+        return
+
+    library = synthetic_library(args.tracks, args.playlists, args.unique_ratio)
+    if args.memory:
+        tracemalloc.start()
+
+    results = []
+    for name in args.only.split(","):
+        result = run(name, library, args)
+        results.append(result)
+        requests = ", ".join(f"{k}={v}" for k, v in sorted(result["requests"].items()))
+        memory = f", peak {result['peak_memory_mb']} MB" if args.memory else ""
+        print(
+            f"{name:>12}: {result['tracks']} tracks in {result['seconds']:.2f}s "
+            f"({result['tracks_per_second']} tracks/s{memory}) [{requests}]"
+        )
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+
+DEFAULT_JOURNAL_FILE = "migration_journal.jsonl"
+
+
+class MigrationJournal:
+    # Append-only JSONL log of a migration: which video was chosen for each track, which
+    # YouTube playlists were created, how many of their songs have been sent and which
+    # of those couldn't be added, so that they are tried again on resume. With
+    # resume set, an existing journal is replayed so that a new run can skip that work;
+    # otherwise it is started over.
+    def __init__(self, path=DEFAULT_JOURNAL_FILE, resume=False):
+        self.path = path
+        # track key -> chosen result ({"videoId", "title", "artists"}), or None if the
+        # track was skipped or had no results.
+        self.choices = {}
+        # playlist key -> {"playlist_id": ..., "added": int, "failed": [video ids],
+        # "done": bool}
+        self.playlists = {}
+        self._lock = threading.Lock()
+
+        if resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        # The last line may be cut short if the previous run was killed.
+                        continue
+        # What had been chosen when the run was resumed, as opposed to during this run.
+        self.resumed = dict(self.choices)
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _apply(self, entry):
+        kind = entry["type"]
+        if kind == "track":
+            self.choices[entry["key"]] = entry["choice"]
+        elif kind == "created":
+            self.playlists[entry["playlist"]] = {
+                "playlist_id": entry["playlist_id"],
+                "added": 0,
+                "failed": [],
+                "done": False,
+            }
+        elif kind == "added":
+            self.playlists[entry["playlist"]]["added"] += entry["count"]
+            self.playlists[entry["playlist"]]["failed"] += entry.get("failed", [])
+        elif kind == "retried":
+            failed = self.playlists[entry["playlist"]]["failed"]
+            for video_id in entry["video_ids"]:
+                failed.remove(video_id)
+            failed += entry["failed"]
+        elif kind == "done":
+            self.playlists.setdefault(
+                entry["playlist"], {"playlist_id": None, "added": 0, "failed": []}
+            )
+            self.playlists[entry["playlist"]]["done"] = True
+
+    def _write(self, entry):
+        with self._lock:
+            self._apply(entry)
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def record_track(self, key, result):
+        choice = None
+        if result:
+            choice = {
+                "videoId": result.get("videoId"),
+                "title": result.get("title"),
+                "artists": result.get("artists", []),
+            }
+        self._write({"type": "track", "key": key, "choice": choice})
+
+    def record_created(self, playlist, playlist_id):
+        self._write({"type": "created", "playlist": playlist, "playlist_id": playlist_id})
+
+    # count songs have been sent, of which the video ids in failed couldn't be added.
+    def record_added(self, playlist, count, failed=()):
+        self._write(
+            {"type": "added", "playlist": playlist, "count": count, "failed": list(failed)}
+        )
+
+    # Songs that couldn't be added before have been sent again, and those in failed
+    # still couldn't be added.
+    def record_retried(self, playlist, video_ids, failed=()):
+        self._write(
+            {
+                "type": "retried",
+                "playlist": playlist,
+                "video_ids": list(video_ids),
+                "failed": list(failed),
+            }
+        )
+
+    def record_done(self, playlist):
+        self._write({"type": "done", "playlist": playlist})
+
+    # A finished playlist with songs that couldn't be added isn't done, so that resuming
+    # tries them again.
+    def is_done(self, playlist):
+        state = self.playlists.get(playlist, {})
+        return state.get("done", False) and not state.get("failed")
+
+    def close(self):
+        self._file.close()
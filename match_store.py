@@ -0,0 +1,115 @@
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_MATCH_FILE = "matches.sqlite"
+
+# A match replaces an existing one for the same track if it was chosen by hand and the
+# existing one wasn't, or if both were chosen the same way and it is at least as new.
+_UPSERT = (
+    "INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT (track) DO UPDATE SET"
+    " video_id = excluded.video_id, title = excluded.title, artists = excluded.artists,"
+    " source = excluded.source, score = excluded.score, updated_at = excluded.updated_at"
+    " WHERE (excluded.source = 'manual' AND matches.source != 'manual')"
+    " OR (excluded.source = matches.source AND excluded.updated_at >= matches.updated_at)"
+)
+
+
+class MatchStore:
+    # Remembers which YouTube Music video was chosen for each Spotify track (by
+    # track_key), whether it was picked automatically ("auto") or by hand ("manual"),
+    # its match score and when, so later runs can use it instead of searching again.
+    # Manual choices are never replaced by automatic ones.
+    def __init__(self, path=DEFAULT_MATCH_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS matches ("
+            " track TEXT PRIMARY KEY,"
+            " video_id TEXT NOT NULL,"
+            " title TEXT,"
+            " artists TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " score REAL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    # Returns every match as a dict mapping the track key to
+    # {"videoId", "title", "artists", "source", "score", "updated_at"}.
+    def matches(self):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM matches").fetchall()
+        return {row[0]: _match(row) for row in rows}
+
+    def get(self, track):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM matches WHERE track = ?", (track,)
+            ).fetchone()
+        return _match(row) if row else None
+
+    # Remembers a search result (or anything else with a videoId) for a track.
+    def put(self, track, result, source="auto"):
+        self.put_many([(track, result)], source)
+
+    def put_many(self, items, source="auto"):
+        now = time.time()
+        rows = [_row(track, result, source, now) for track, result in items]
+        with self._lock:
+            self._db.executemany(_UPSERT, [row for row in rows if row[1]])
+            self._db.commit()
+
+    def export_json(self, path):
+        matches = self.matches()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"matches": [dict(m, track=track) for track, m in matches.items()]},
+                f,
+                indent=2,
+            )
+        return len(matches)
+
+    # Merges matches exported by export_json, by the same rules as put. Returns the
+    # number of matches read.
+    def import_json(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            matches = json.load(f)["matches"]
+        rows = [
+            _row(m["track"], m, m.get("source", "auto"), m.get("updated_at") or time.time())
+            for m in matches
+        ]
+        with self._lock:
+            self._db.executemany(_UPSERT, [row for row in rows if row[1]])
+            self._db.commit()
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _row(track, result, source, updated_at):
+    return (
+        track,
+        result.get("videoId"),
+        result.get("title"),
+        json.dumps(result.get("artists") or []),
+        source,
+        result.get("score"),
+        updated_at,
+    )
+
+
+def _match(row):
+    return {
+        "videoId": row[1],
+        "title": row[2],
+        "artists": json.loads(row[3]),
+        "source": row[4],
+        "score": row[5],
+        "updated_at": row[6],
+    }
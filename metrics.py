@@ -0,0 +1,111 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets; slower calls go in "inf".
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    # Collects what a run did, for a machine readable report: per API call type the
+    # number of calls, errors and a latency histogram, named counters (retries,
+    # throttling, ...) and how long each phase of the run took. Safe to share between
+    # threads.
+    def __init__(self):
+        self.started = time.time()
+        self.calls = {}
+        self.counters = {}
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, error=False):
+        with self._lock:
+            call = self.calls.get(name)
+            if call is None:
+                call = self.calls[name] = {
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "histogram": {str(b): 0 for b in LATENCY_BUCKETS + ("inf",)},
+                }
+            call["count"] += 1
+            call["errors"] += bool(error)
+            call["seconds"] += seconds
+            call["max_seconds"] = max(call["max_seconds"], seconds)
+            bucket = next((b for b in LATENCY_BUCKETS if seconds <= b), "inf")
+            call["histogram"][str(bucket)] += 1
+
+    def increment(self, name, count=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def report(self, **extra):
+        with self._lock:
+            calls = {
+                name: dict(
+                    call,
+                    seconds=round(call["seconds"], 3),
+                    max_seconds=round(call["max_seconds"], 3),
+                    mean_seconds=round(call["seconds"] / call["count"], 3),
+                )
+                for name, call in self.calls.items()
+            }
+            return {
+                "started": self.started,
+                "seconds": round(time.time() - self.started, 3),
+                "phases": {name: round(s, 3) for name, s in self.phases.items()},
+                "calls": calls,
+                "counters": dict(self.counters),
+                **extra,
+            }
+
+    def write_report(self, path, **extra):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, indent=2)
+
+
+class Progress:
+    # Counts finished items and shows the rate and an ETA. With live set, a single line
+    # on stderr is rewritten on every update; otherwise a line is printed every `every`
+    # items.
+    def __init__(self, total, label, live=False, every=100):
+        self.total = total
+        self.label = label
+        self.live = live
+        self.every = every
+        self.done = 0
+        self._start = time.perf_counter()
+
+    def update(self, count=1):
+        self.done += count
+        if self.live:
+            sys.stderr.write("\r" + self.line())
+            sys.stderr.flush()
+        elif self.done % self.every == 0:
+            print(f"   {self.line()}")
+
+    def close(self):
+        if self.live:
+            sys.stderr.write("\r" + self.line() + "\n")
+
+    def line(self):
+        elapsed = time.perf_counter() - self._start
+        rate = self.done / elapsed if elapsed else 0
+        eta = (self.total - self.done) / rate if rate else 0
+        minutes, seconds = divmod(int(eta), 60)
+        return (
+            f"{self.label} {self.done}/{self.total} ({rate:.1f}/s, ETA {minutes}m{seconds:02d}s)"
+        )
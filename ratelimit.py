@@ -0,0 +1,234 @@
+import logging
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class APIError(Exception):
+    # Raised by Retrier.call when a request fails for good: the error isn't worth
+    # retrying, the tries or the endpoint's retry budget ran out, or its circuit is open.
+    def __init__(self, endpoint, message, status=None, attempts=0, cause=None):
+        super().__init__(f"{endpoint}: {message}")
+        self.endpoint = endpoint
+        self.status = status
+        self.attempts = attempts
+        self.cause = cause
+
+
+class CircuitOpenError(APIError):
+    pass
+
+
+# Returns the HTTP status of an error from urllib/http.client, or the one mentioned in
+# a ytmusicapi error message ("Server returned HTTP 429: ..."), if there is one.
+def status_of(err):
+    status = getattr(err, "code", None) or getattr(err, "status", None)
+    if isinstance(status, int):
+        return status
+    match = re.search(r"HTTP (\d{3})", str(err))
+    return int(match.group(1)) if match else None
+
+
+# Returns True if an exception from an API call looks like the server asking us to slow
+# down (HTTP 429, or a 503 that is often used the same way).
+def is_throttled(err):
+    return status_of(err) in (429, 503) or "Too Many Requests" in str(err)
+
+
+# Server errors, throttling and network problems are worth retrying. Other 4xx errors
+# mean the request itself is wrong and will fail the same way again.
+def is_retryable(err):
+    status = status_of(err)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    # Imported here because it's slow to import and only needed once something failed.
+    import http.client
+
+    return isinstance(err, (OSError, TimeoutError, http.client.HTTPException))
+
+
+# Seconds the server asked us to wait, from a Retry-After header.
+def retry_after(err):
+    headers = getattr(err, "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class Retrier:
+    # Calls API functions with retries, shared by all threads of a run.
+    #
+    # Failed tries are retried after an exponential backoff with full jitter, or after
+    # Retry-After if the server sent one. Being throttled doesn't use up a try, but it
+    # still makes the backoff grow, and every retry counts against a budget per endpoint
+    # so that a run that is being throttled or failing constantly gives up instead of
+    # retrying forever. Each successful call earns back `refill` of a retry (up to the
+    # full budget), so a long run that only fails now and then never runs out. After
+    # failure_threshold calls in a row have given up on retryable errors, an endpoint's
+    # circuit opens and calls to it fail immediately until cooldown seconds have passed.
+    # Errors that aren't worth retrying are the request's fault, not the server's, so
+    # they don't count.
+    #
+    # If a TokenBucket is given, calls wait for it and slow it down when throttled. If a
+    # metrics.Metrics is given, every try is timed under its endpoint's name and retries
+    # and throttling are counted.
+    def __init__(
+        self,
+        tries=4,
+        base_delay=0.5,
+        max_delay=60.0,
+        budget=500,
+        refill=0.1,
+        failure_threshold=5,
+        cooldown=60.0,
+        limiter=None,
+        metrics=None,
+    ):
+        self.tries = tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.refill = refill
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.limiter = limiter
+        self.metrics = metrics
+        self._budgets = {}
+        self._failures = {}
+        self._opened_at = {}
+        self._lock = threading.Lock()
+
+    def call(self, endpoint, fn, *args, tries=None, **kwargs):
+        tries = tries or self.tries
+        attempt = 0
+        throttles = 0
+        while True:
+            self._check_circuit(endpoint)
+            if self.limiter:
+                self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as err:
+                if self.metrics:
+                    self.metrics.observe(endpoint, time.perf_counter() - start, error=True)
+                throttled = is_throttled(err)
+                if throttled:
+                    throttles += 1
+                else:
+                    attempt += 1
+                if not is_retryable(err):
+                    raise APIError(endpoint, str(err), status_of(err), attempt, err) from err
+                if attempt >= tries:
+                    self._record_failure(endpoint)
+                    message = f"gave up after {attempt} tries: {err}"
+                    raise APIError(endpoint, message, status_of(err), attempt, err) from err
+                if not self._spend_budget(endpoint):
+                    self._record_failure(endpoint)
+                    message = f"retry budget exhausted: {err}"
+                    raise APIError(endpoint, message, status_of(err), attempt, err) from err
+
+                delay = retry_after(err)
+                if delay is None:
+                    backoff = min(self.max_delay, self.base_delay * 2 ** (attempt + throttles))
+                    delay = random.uniform(0, backoff)
+                if throttled and self.limiter:
+                    delay = max(delay, self.limiter.throttled())
+                logger.warning(f"{endpoint} failed ({err}), retrying in {delay:.1f}s")
+                if self.metrics:
+                    self.metrics.increment(f"retries.{endpoint}")
+                    if throttled:
+                        self.metrics.increment(f"throttled.{endpoint}")
+                time.sleep(delay)
+                continue
+
+            if self.metrics:
+                self.metrics.observe(endpoint, time.perf_counter() - start)
+            with self._lock:
+                self._failures[endpoint] = 0
+                left = self._budgets.get(endpoint, self.budget)
+                self._budgets[endpoint] = min(self.budget, left + self.refill)
+            if self.limiter:
+                self.limiter.succeeded()
+            return result
+
+    def _check_circuit(self, endpoint):
+        with self._lock:
+            opened_at = self._opened_at.get(endpoint)
+            if opened_at is None:
+                return
+            if time.monotonic() - opened_at < self.cooldown:
+                raise CircuitOpenError(
+                    endpoint, f"too many failures in a row, paused for {self.cooldown:.0f}s"
+                )
+            # Half open: let this call through, if it gives up too the circuit opens again.
+            del self._opened_at[endpoint]
+            self._failures[endpoint] = self.failure_threshold - 1
+
+    def _record_failure(self, endpoint):
+        with self._lock:
+            self._failures[endpoint] = self._failures.get(endpoint, 0) + 1
+            if self._failures[endpoint] >= self.failure_threshold:
+                self._opened_at[endpoint] = time.monotonic()
+
+    def _spend_budget(self, endpoint):
+        with self._lock:
+            left = self._budgets.get(endpoint, self.budget)
+            if left <= 0:
+                return False
+            self._budgets[endpoint] = left - 1
+            return True
+
+
+class TokenBucket:
+    # Allows `rate` calls per second on average with bursts of up to `burst` calls,
+    # shared between any number of threads. When the server throttles us the rate is
+    # halved (down to min_rate) and every caller waits out an exponentially growing
+    # pause; successful calls slowly bring the rate back up to where it started.
+    def __init__(self, rate, burst=None, min_rate=0.2, max_backoff=60.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.min_rate = min_rate
+        self.max_backoff = max_backoff
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._backoff = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(
+                        self.burst, self._tokens + (now - self._updated) * self.rate
+                    )
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._backoff = min(self.max_backoff, max(1.0, self._backoff * 2))
+            pause = self._backoff * random.uniform(0.5, 1.0)
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            self._tokens = 0
+            return pause
+
+    def succeeded(self):
+        with self._lock:
+            self._backoff = 0.0
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate * 1.05)
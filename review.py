@@ -0,0 +1,60 @@
+import csv
+import json
+
+# Number of candidates listed per track in a review file.
+REVIEW_OPTIONS = 5
+
+
+def describe(result):
+    artists = ", ".join(a["name"] for a in result.get("artists") or [])
+    score = f" | {result['score']:.0%}" if result.get("score") is not None else ""
+    return f"{result.get('videoId')} | {result.get('title')} – {artists}{score}"
+
+
+# Writes tracks to review, given as (key, song, results), to a .csv or .json file. Each
+# track has a "choice" to fill in with the number of one of its results, any other
+# videoId, or nothing to skip the track. It is empty unless choices (a dict mapping the
+# track key to the text of its choice) has one for the track.
+def write_review_file(path, pending, choices=None):
+    choices = choices or {}
+    if path.endswith(".csv"):
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["track", "title", "artists", "choice"]
+                + [f"option {i}" for i in range(REVIEW_OPTIONS)]
+            )
+            for key, song, results in pending:
+                writer.writerow(
+                    [key, song["title"], ", ".join(song["artists"]), choices.get(key, "")]
+                    + [describe(r) for r in results[:REVIEW_OPTIONS]]
+                )
+        return
+
+    tracks = [
+        {
+            "track": key,
+            "title": song["title"],
+            "artists": song["artists"],
+            "choice": choices.get(key, ""),
+            "options": [describe(r) for r in results[:REVIEW_OPTIONS]],
+        }
+        for key, song, results in pending
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"tracks": tracks}, f, indent=2, ensure_ascii=False)
+
+
+# Returns the choices filled into a file written by write_review_file, as a dict mapping
+# the track key to the text of its choice.
+def read_review_file(path):
+    if path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return {row["track"]: (row["choice"] or "").strip() for row in csv.DictReader(f)}
+
+    with open(path, "r", encoding="utf-8") as f:
+        tracks = json.load(f)["tracks"]
+    return {
+        t["track"]: "" if t.get("choice") is None else str(t["choice"]).strip()
+        for t in tracks
+    }
@@ -0,0 +1,90 @@
+import difflib
+import re
+
+# How much each part of a match counts. Duration and album only count when both the
+# Spotify track and the candidate have one; otherwise the remaining weights are scaled
+# up to match.
+TITLE_WEIGHT = 0.35
+ARTIST_WEIGHT = 0.35
+TEXT_WEIGHT = 0.15
+DURATION_WEIGHT = 0.15
+ALBUM_WEIGHT = 0.1
+
+# Durations within DURATION_TOLERANCE seconds count as a full match, falling off to no
+# match at all DURATION_CUTOFF seconds apart.
+DURATION_TOLERANCE = 3
+DURATION_CUTOFF = 30
+
+
+def tokens(text):
+    return set(re.findall(r"\w+", text.casefold()))
+
+
+def token_similarity(a, b):
+    union = a | b
+    return len(a & b) / len(union) if union else 0
+
+
+def duration_similarity(expected, actual):
+    delta = abs(expected - actual)
+    if delta <= DURATION_TOLERANCE:
+        return 1.0
+    return max(0.0, 1 - (delta - DURATION_TOLERANCE) / (DURATION_CUTOFF - DURATION_TOLERANCE))
+
+
+def candidate_artists(item):
+    return ", ".join(a["name"] for a in item.get("artists") or [])
+
+
+# Search results for songs have an album ({"name", "id"}), videos don't.
+def candidate_album(item):
+    album = item.get("album")
+    return album.get("name") if isinstance(album, dict) else album
+
+
+class Matcher:
+    # Scores YouTube Music search results against one Spotify song. Everything about the
+    # song is tokenized once up front, and the song's text is kept as the cached second
+    # sequence of a SequenceMatcher, so each candidate only costs its own tokenization.
+    def __init__(self, song):
+        title = song["title"].casefold()
+        artists = ", ".join(song["artists"]).casefold()
+        self.title_tokens = tokens(title)
+        self.artist_tokens = tokens(artists)
+        duration_ms = song.get("duration_ms")
+        self.duration = duration_ms / 1000 if duration_ms else None
+        self.album_tokens = tokens(song.get("album") or "")
+        self._text = difflib.SequenceMatcher(None, autojunk=False)
+        self._text.set_seq2(f"{title} {artists}")
+
+    def score(self, item):
+        title = item.get("title") or ""
+        artists = candidate_artists(item)
+        self._text.set_seq1(f"{title} {artists}".casefold())
+
+        parts = [
+            (TITLE_WEIGHT, token_similarity(self.title_tokens, tokens(title))),
+            (ARTIST_WEIGHT, token_similarity(self.artist_tokens, tokens(artists))),
+            (TEXT_WEIGHT, self._text.ratio()),
+        ]
+        duration = item.get("duration_seconds")
+        if self.duration and duration:
+            parts.append((DURATION_WEIGHT, duration_similarity(self.duration, duration)))
+        album = candidate_album(item)
+        if self.album_tokens and album:
+            parts.append((ALBUM_WEIGHT, token_similarity(self.album_tokens, tokens(album))))
+        return sum(w * s for w, s in parts) / sum(w for w, _ in parts)
+
+    # A candidate is confirmed unless both durations are known and too far apart.
+    def confirms(self, item):
+        duration = item.get("duration_seconds")
+        if not self.duration or not duration:
+            return True
+        return abs(self.duration - duration) <= DURATION_TOLERANCE
+
+    # Scores all candidates and returns them as (score, item) pairs, best first. Equal
+    # scores keep the order they were given in.
+    def rank(self, items):
+        scored = [(self.score(item), item) for item in items if item]
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return scored
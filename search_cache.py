@@ -0,0 +1,128 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+DEFAULT_CACHE_FILE = "search_cache.sqlite"
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 200000
+
+# Eviction is only checked every so many writes so that puts stay cheap.
+_EVICT_EVERY = 500
+
+
+def normalize_query(query):
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class SearchCache:
+    # Persistent cache of YTMusic search results, keyed on the normalized query and the
+    # search filter. Entries older than ttl seconds are ignored and the table is trimmed
+    # back to max_entries (least recently used first) as it grows.
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_FILE,
+        ttl=DEFAULT_TTL_DAYS * 86400,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        refresh=False,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS search ("
+            " query TEXT NOT NULL,"
+            " filter TEXT NOT NULL,"
+            " results TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (query, filter))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS search_accessed_at ON search (accessed_at)"
+        )
+        self._db.commit()
+
+    def get(self, query, filter):
+        # With refresh set, every lookup misses so that results are fetched again and
+        # overwritten in the cache.
+        if self.refresh:
+            self.misses += 1
+            return None
+
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT results, created_at FROM search WHERE query = ? AND filter = ?",
+                (key, filter or ""),
+            ).fetchone()
+            if row is None or (self.ttl and row[1] < now - self.ttl):
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE search SET accessed_at = ? WHERE query = ? AND filter = ?",
+                (now, key, filter or ""),
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, query, filter, results):
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO search VALUES (?, ?, ?, ?, ?)",
+                (key, filter or "", json.dumps(results), now, now),
+            )
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if self.ttl:
+            self._db.execute(
+                "DELETE FROM search WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+        if self.max_entries:
+            self._db.execute(
+                "DELETE FROM search WHERE rowid IN ("
+                " SELECT rowid FROM search ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._db.commit()
+            self._db.close()
+
+
+class CachedYTMusic:
+    # Wraps a YTMusic client so that search() goes through a SearchCache. Every other
+    # attribute is passed straight through to the wrapped client.
+    def __init__(self, ytmusic, cache):
+        self._ytmusic = ytmusic
+        self._cache = cache
+
+    def search(self, query, filter=None, **kwargs):
+        if kwargs:
+            return self._ytmusic.search(query, filter=filter, **kwargs)
+        results = self._cache.get(query, filter)
+        if results is None:
+            results = self._ytmusic.search(query, filter=filter)
+            self._cache.put(query, filter, results)
+        return results
+
+    def __getattr__(self, name):
+        return getattr(self._ytmusic, name)
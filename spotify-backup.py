@@ -1,67 +1,159 @@
 import argparse
 import codecs
+import gzip
 import http.client
 import http.server
+import itertools
 import json
 import logging
+import os
+import queue
 import re
 import sys
 import time
 import urllib.error
 import urllib.parse
-import urllib.request
-import webbrowser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from backup_file import load_playlists
+from metrics import Metrics
+from ratelimit import APIError, Retrier
 
 logging.basicConfig(level=20, datefmt="%I:%M:%S", format="[%(asctime)s] %(message)s")
 
 
+API_URL = "https://api.spotify.com/v1/"
+
+
 class SpotifyAPI:
 
-    # Requires an OAuth token.
-    def __init__(self, auth):
+    # Requires an OAuth token. With more than one worker, the pages of a list are
+    # fetched concurrently. api_url can point somewhere else for testing. Requests are
+    # recorded in metrics, if given.
+    def __init__(self, auth, workers=1, api_url=API_URL, metrics=None):
         self._auth = auth
+        self._api_url = api_url
+        parts = urllib.parse.urlsplit(api_url)
+        self._origin = f"{parts.scheme}://{parts.netloc}"
+        if parts.scheme == "https":
+            self._connect = lambda: http.client.HTTPSConnection(parts.netloc, timeout=30)
+        else:
+            self._connect = lambda: http.client.HTTPConnection(parts.netloc, timeout=30)
+        self._workers = workers
+        self._pages = ThreadPoolExecutor(workers) if workers > 1 else None
+        # Idle keep-alive connections to the API, so that every request doesn't have to
+        # pay for a new TLS handshake.
+        self._connections = queue.LifoQueue()
+        self._retrier = Retrier(metrics=metrics)
+
+    # Sends a GET request over a pooled connection and decodes the (possibly gzipped)
+    # JSON body straight from the response stream. Raises HTTPError for error statuses.
+    def _request(self, url):
+        try:
+            conn = self._connections.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = self._connect()
+            reused = False
+
+        try:
+            conn.request(
+                "GET",
+                url[len(self._origin) :],
+                headers={
+                    "Authorization": "Bearer " + self._auth,
+                    "Accept-Encoding": "gzip",
+                },
+            )
+            res = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionError):
+            conn.close()
+            # The server may have dropped a connection that sat idle in the pool.
+            if reused:
+                return self._request(url)
+            raise
+        except Exception:
+            conn.close()
+            raise
+
+        try:
+            if res.status >= 400:
+                res.read()
+                raise urllib.error.HTTPError(url, res.status, res.reason, res.headers, None)
+            body = res
+            if res.getheader("Content-Encoding") == "gzip":
+                body = gzip.GzipFile(fileobj=res)
+            reader = codecs.getreader("utf-8")
+            data = json.load(reader(body))
+        except urllib.error.HTTPError:
+            self._connections.put(conn)
+            raise
+        except Exception:
+            conn.close()
+            raise
+        self._connections.put(conn)
+        return data
 
-    # Gets a resource from the Spotify API and returns the object.
+    # Gets a resource from the Spotify API and returns the object. Failures are retried
+    # by the shared Retrier, which honours Retry-After and backs off with jitter.
     def get(self, url, params={}, tries=3):
         # Construct the correct URL.
-        if not url.startswith("https://api.spotify.com/v1/"):
-            url = "https://api.spotify.com/v1/" + url
+        if not url.startswith(self._api_url):
+            url = self._api_url + url
         if params:
             url += ("&" if "?" in url else "?") + urllib.parse.urlencode(params)
 
         # Try the sending off the request a specified number of times before giving up.
-        for _ in range(tries):
-            try:
-                req = urllib.request.Request(url)
-                req.add_header("Authorization", "Bearer " + self._auth)
-                res = urllib.request.urlopen(req)
-                reader = codecs.getreader("utf-8")
-                return json.load(reader(res))
-            except Exception as err:
-                logging.info("Couldn't load URL: {} ({})".format(url, err))
-                time.sleep(2)
-                logging.info("Trying again...")
-        sys.exit(1)
+        # Raises APIError if it still fails.
+        return self._retrier.call(_endpoint(url), self._request, url, tries=tries)
 
     # The Spotify API breaks long lists into multiple pages. This method automatically
     # fetches all pages and joins them, returning in a single list of objects.
     def list(self, url, params={}):
-        last_log_time = time.time()
-        response = self.get(url, params)
-        items = response["items"]
+        return list(self.iterate(url, params))
 
-        while response["next"]:
+    # Like list(), but yields the objects as their pages arrive, so that callers can
+    # write them out without holding the whole list in memory.
+    def iterate(self, url, params={}):
+        last_log_time = time.time()
+        first = self.get(url, params)
+        loaded = 0
+        for page in itertools.chain([first], self._following_pages(first)):
             if time.time() > last_log_time + 15:
                 last_log_time = time.time()
-                logging.info(f"Loaded {len(items)}/{response['total']} items")
+                logging.info(f"Loaded {loaded}/{first['total']} items")
+            loaded += len(page["items"])
+            yield from page["items"]
+
+    def _following_pages(self, response):
+        # The first page tells us how many items there are, so the following pages can be
+        # requested ahead of time. They are still yielded in order, so the result is the
+        # same, and only a few pages are fetched ahead of the caller.
+        if self._pages and response["next"]:
+            limit = response["limit"]
+            offsets = range(response["offset"] + limit, response["total"], limit)
+            pending = deque()
+            for offset in offsets:
+                pending.append(
+                    self._pages.submit(self.get, _with_offset(response["next"], offset))
+                )
+                if len(pending) >= self._workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+            return
 
+        while response["next"]:
             response = self.get(response["next"])
-            items += response["items"]
-        return items
+            yield response
 
     # Pops open a browser window for a user to log in and authorize API access.
     @staticmethod
-    def authorize(client_id, scope):
+    def authorize(client_id, scope, workers=1, metrics=None):
+        # Only needed when logging in through the browser, and slow to import.
+        import webbrowser
+
         url = "https://accounts.spotify.com/authorize?" + urllib.parse.urlencode(
             {
                 "response_type": "token",
@@ -81,7 +173,7 @@ class SpotifyAPI:
             while True:
                 server.handle_request()
         except SpotifyAPI._Authorization as auth:
-            return SpotifyAPI(auth.access_token)
+            return SpotifyAPI(auth.access_token, workers, metrics=metrics)
 
     # The port that the local server listens on. Don't change this,
     # as Spotify only will redirect to certain predefined URLs.
@@ -134,6 +226,222 @@ class SpotifyAPI:
             self.access_token = access_token
 
 
+# Names the API endpoint of a URL for the Retrier's per-endpoint budgets and circuits,
+# leaving out IDs, e.g. "playlists/tracks" for .../v1/playlists/{id}/tracks?offset=100.
+def _endpoint(url):
+    path = urllib.parse.urlsplit(url).path[len("/v1/") :].strip("/").split("/")
+    return "/".join([path[0], path[-1]] if len(path) > 1 else path)
+
+
+# Returns a copy of a paging URL that starts at a different offset.
+def _with_offset(url, offset):
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    query["offset"] = str(offset)
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+# The only parts of a playlist track that --slim keeps. For playlists the API is asked
+# to leave out everything else, so it isn't even downloaded.
+SLIM_FIELDS = (
+    "items(added_at,is_local,track(uri,name,artists(name),album(name,release_date),"
+    + "duration_ms,external_ids(isrc))),next,total,limit,offset"
+)
+
+
+# Projects a playlist or liked track onto the compact --slim schema. Artists and album
+# become plain names and the ISRC is moved up from external_ids.
+def slim_track(item):
+    track = item["track"]
+    # Tracks reused from a slim previous backup are already projected.
+    if track is None or "isrc" in track:
+        return item
+    album = track.get("album") or {}
+    return {
+        "added_at": item.get("added_at"),
+        "is_local": item.get("is_local", False),
+        "track": {
+            "uri": track.get("uri"),
+            "name": track["name"],
+            "artists": [artist["name"] for artist in track.get("artists", [])],
+            "album": album.get("name"),
+            "duration_ms": track.get("duration_ms"),
+            "isrc": (track.get("external_ids") or {}).get("isrc"),
+            "release_date": album.get("release_date"),
+        },
+    }
+
+
+# Tells whether a playlist from a previous backup has tracks in the --slim schema.
+def has_slim_tracks(playlist):
+    return any(item.get("track") and "isrc" in item["track"] for item in playlist["tracks"])
+
+
+# Returns the function applied to every track as it is downloaded, and the query
+# parameters used for pages of playlist tracks.
+def track_projection(slim):
+    if slim:
+        return slim_track, {"limit": 100, "fields": SLIM_FIELDS}
+    return (lambda item: item), {"limit": 100}
+
+
+# Returns the tracks of a playlist. With a previous backup (a dict of its playlists by ID
+# or name), a playlist whose snapshot_id hasn't changed since is taken from it instead
+# of being downloaded again.
+def playlist_tracks(spotify, playlist, previous, track_params):
+    old = previous.get(playlist["id"])
+    if old and old.get("snapshot_id") == playlist.get("snapshot_id"):
+        logging.info("Unchanged since previous backup: {name}".format(**playlist))
+        return iter(old["tracks"])
+    logging.info("Loading playlist: {name} ({tracks[total]} songs)".format(**playlist))
+    return spotify.iterate(playlist["tracks"]["href"], track_params)
+
+
+# Returns the liked songs. Liked songs have no snapshot_id, but they are listed newest
+# first, so with a previous backup only the songs added since are downloaded and the
+# rest are taken from it. If the total doesn't add up, songs must have been unliked as
+# well, and everything is downloaded again.
+def liked_tracks(spotify, previous):
+    old = previous.get("Liked Songs")
+    if not old or not old["tracks"]:
+        return spotify.iterate("me/tracks", {"limit": 50})
+
+    newest = max(item["added_at"] for item in old["tracks"])
+    known = {item["track"]["uri"] for item in old["tracks"] if item.get("track")}
+    new = []
+    for item in spotify.iterate("me/tracks", {"limit": 50}):
+        if item["added_at"] <= newest and item["track"]["uri"] in known:
+            break
+        new.append(item)
+
+    total = spotify.get("me/tracks", {"limit": 1})["total"]
+    if len(new) + len(old["tracks"]) != total:
+        logging.info("Liked songs were removed since the previous backup, loading all")
+        return spotify.iterate("me/tracks", {"limit": 50})
+    logging.info(f"{len(new)} liked songs added since the previous backup")
+    return itertools.chain(new, old["tracks"])
+
+
+# Yields the playlists to back up with their tracks: Liked Songs first, if in dump, then
+# the user's playlists. With more than one worker, the tracks of up to `workers`
+# playlists are downloaded at the same time and each playlist is yielded as soon as it
+# and the ones before it are complete, so only those few playlists are held in memory.
+# Otherwise each playlist's "tracks" is an iterator that downloads the tracks as it is
+# consumed.
+def backup_playlists(spotify, me, dump, slim=False, previous={}, workers=1):
+    project, track_params = track_projection(slim)
+    if "liked" in dump:
+        logging.info("Loading liked songs...")
+        yield {"name": "Liked Songs", "tracks": map(project, liked_tracks(spotify, previous))}
+
+    if "playlists" not in dump:
+        return
+    logging.info("Loading playlists...")
+    playlist_data = spotify.list(
+        "users/{user_id}/playlists".format(user_id=me["id"]), {"limit": 50}
+    )
+    logging.info(f"Found {len(playlist_data)} playlists")
+
+    def load_tracks(playlist):
+        tracks = playlist_tracks(spotify, playlist, previous, track_params)
+        return dict(playlist, tracks=list(map(project, tracks)))
+
+    if workers <= 1:
+        for playlist in playlist_data:
+            tracks = playlist_tracks(spotify, playlist, previous, track_params)
+            yield dict(playlist, tracks=map(project, tracks))
+        return
+
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        for playlist in playlist_data:
+            pending.append(pool.submit(load_tracks, playlist))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def liked_albums(spotify, dump):
+    if "liked" not in dump:
+        return iter([])
+    return spotify.iterate("me/albums", {"limit": 50})
+
+
+# Writes a JSON backup, {"playlists": [...], "albums": [...]}, one playlist at a time
+# as they arrive. The tracks of a playlist are written one by one too, so the output
+# is the same as json.dump() of the whole backup without ever holding all of it.
+def write_json(f, playlists, albums):
+    f.write('{"playlists": [')
+    for i, playlist in enumerate(playlists):
+        if i:
+            f.write(", ")
+        fields = []
+        for key, value in playlist.items():
+            if key != "tracks":
+                fields.append(f"{json.dumps(key)}: {json.dumps(value)}")
+                continue
+            f.write("{" + "".join(field + ", " for field in fields) + '"tracks": [')
+            fields = []
+            for j, track in enumerate(value):
+                f.write((", " if j else "") + json.dumps(track))
+            f.write("]")
+        f.write("".join(", " + field for field in fields) + "}")
+        f.flush()
+    f.write('], "albums": [')
+    for i, album in enumerate(albums):
+        f.write((", " if i else "") + json.dumps(album))
+    f.write("]}")
+
+
+# Writes an NDJSON backup: a {"type": "playlist", ...} line per playlist, each followed
+# by a {"type": "track", ...} line per track, and then a {"type": "album", ...} line per
+# liked album.
+def write_ndjson(f, playlists, albums):
+    for playlist in playlists:
+        info = {k: v for k, v in playlist.items() if k != "tracks"}
+        f.write(json.dumps({**info, "type": "playlist"}) + "\n")
+        for track in playlist["tracks"]:
+            f.write(json.dumps({**track, "type": "track"}) + "\n")
+        f.flush()
+    for album in albums:
+        f.write(json.dumps({**album, "type": "album"}) + "\n")
+
+
+# Writes a tab-separated backup: every playlist's name followed by a line per track,
+# then the liked albums, if there are any.
+def write_txt(f, playlists, albums):
+    f.write("Playlists: \r\n\r\n")
+    for playlist in playlists:
+        rows = [playlist["name"] + "\r\n"]
+        for item in playlist["tracks"]:
+            track = item["track"]
+            if track is None:
+                continue
+            album = track["album"]
+            artists = ", ".join([artist["name"] for artist in track["artists"]])
+            rows.append(
+                f"{track['name']}\t{artists}\t{album['name']}\t{track['uri']}"
+                f"\t{album['release_date']}\r\n"
+            )
+        rows.append("\r\n")
+        f.write("".join(rows))
+        f.flush()
+
+    rows = []
+    for item in albums:
+        album = item["album"]
+        artists = ", ".join([artist["name"] for artist in album["artists"]])
+        rows.append(
+            f"{album['name']}\t{artists}\t-\t{album['uri']}\t{album['release_date']}\r\n"
+        )
+    if rows:
+        f.write("Liked Albums: \r\n\r\n" + "".join(rows))
+
+
+WRITERS = {"json": write_json, "ndjson": write_ndjson, "txt": write_txt}
+
+
 def main():
     # Parse arguments.
     parser = argparse.ArgumentParser(
@@ -156,9 +464,32 @@ def main():
     parser.add_argument(
         "--format",
         default="txt",
-        choices=["json", "txt"],
+        choices=["json", "ndjson", "txt"],
         help="output format (default: txt)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of playlists and pages to download at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--slim",
+        action="store_true",
+        help="only keep each track's uri, name, artists, album, duration, ISRC and "
+        + "release date (json and ndjson only)",
+    )
+    parser.add_argument(
+        "--incremental",
+        metavar="PREVIOUS",
+        help="reuse playlists that haven't changed since a previous json or ndjson "
+        + "backup (it may be the output file itself)",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="FILE",
+        help="write a JSON report of the run (timings, requests, retries)",
+    )
     parser.add_argument("file", help="output filename", nargs="?")
     args = parser.parse_args()
 
@@ -167,13 +498,33 @@ def main():
         args.file = input("Enter a file name (e.g. playlists.txt): ")
         args.format = args.file.split(".")[-1]
 
+    if args.slim and args.format not in ("json", "ndjson"):
+        parser.error("--slim can only be used with --format=json or --format=ndjson")
+
+    # Read the previous backup completely, since it may be about to be overwritten.
+    previous = {}
+    if args.incremental:
+        previous = {
+            playlist.get("id") or playlist["name"]: playlist
+            for playlist in load_playlists(args.incremental)
+        }
+        # Full tracks can be slimmed down again, but slim ones can't be filled back in,
+        # so a slim backup only helps another slim one.
+        if not args.slim and any(map(has_slim_tracks, previous.values())):
+            logging.info("The previous backup was made with --slim, loading everything")
+            previous = {}
+
+    metrics = Metrics()
+
     # Log into the Spotify API.
     if args.token:
-        spotify = SpotifyAPI(args.token)
+        spotify = SpotifyAPI(args.token, args.workers, metrics=metrics)
     else:
         spotify = SpotifyAPI.authorize(
             client_id="5c098bcc800e45d49e476265bc9b6934",
             scope="playlist-read-private playlist-read-collaborative user-library-read",
+            workers=args.workers,
+            metrics=metrics,
         )
 
     # Get the ID of the logged in user.
@@ -181,76 +532,29 @@ def main():
     me = spotify.get("me")
     logging.info("Logged in as {display_name} ({id})".format(**me))
 
-    playlists = []
-    liked_albums = []
-
-    # List liked albums and songs
-    if "liked" in args.dump:
-        logging.info("Loading liked albums and songs...")
-        liked_tracks = spotify.list("me/tracks", {"limit": 50})
-        liked_albums = spotify.list("me/albums", {"limit": 50})
-        playlists += [{"name": "Liked Songs", "tracks": liked_tracks}]
-
-    # List all playlists and the tracks in each playlist
-    if "playlists" in args.dump:
-        logging.info("Loading playlists...")
-        playlist_data = spotify.list(
-            "users/{user_id}/playlists".format(user_id=me["id"]), {"limit": 50}
+    # Each playlist is written as soon as it has been downloaded, instead of all of them
+    # at the end. They go to a temporary file that only replaces the output once the
+    # backup is complete, so a failed run never destroys the previous backup (which may
+    # be the --incremental one). Unknown extensions typed at the prompt get txt.
+    write = WRITERS.get(args.format, write_txt)
+    tmp = args.file + ".tmp"
+    with metrics.phase("download"), open(tmp, "w", encoding="utf-8") as f:
+        write(
+            f,
+            backup_playlists(spotify, me, args.dump, args.slim, previous, args.workers),
+            liked_albums(spotify, args.dump),
         )
-        logging.info(f"Found {len(playlist_data)} playlists")
-
-        # List all tracks in each playlist
-        for playlist in playlist_data:
-            logging.info(
-                "Loading playlist: {name} ({tracks[total]} songs)".format(**playlist)
-            )
-            playlist["tracks"] = spotify.list(
-                playlist["tracks"]["href"], {"limit": 100}
-            )
-        playlists += playlist_data
-
-    # Write the file.
-    logging.info("Writing files...")
-    with open(args.file, "w", encoding="utf-8") as f:
-        # JSON file.
-        if args.format == "json":
-            json.dump({"playlists": playlists, "albums": liked_albums}, f)
-
-        # Tab-separated file.
-        else:
-            f.write("Playlists: \r\n\r\n")
-            for playlist in playlists:
-                f.write(playlist["name"] + "\r\n")
-                for track in playlist["tracks"]:
-                    if track["track"] is None:
-                        continue
-                    f.write(
-                        "{name}\t{artists}\t{album}\t{uri}\t{release_date}\r\n".format(
-                            uri=track["track"]["uri"],
-                            name=track["track"]["name"],
-                            artists=", ".join(
-                                [artist["name"] for artist in track["track"]["artists"]]
-                            ),
-                            album=track["track"]["album"]["name"],
-                            release_date=track["track"]["album"]["release_date"],
-                        )
-                    )
-                f.write("\r\n")
-            if len(liked_albums) > 0:
-                f.write("Liked Albums: \r\n\r\n")
-                for album in liked_albums:
-                    uri = album["album"]["uri"]
-                    name = album["album"]["name"]
-                    artists = ", ".join(
-                        [artist["name"] for artist in album["album"]["artists"]]
-                    )
-                    release_date = album["album"]["release_date"]
-                    album = f"{artists} - {name}"
-
-                    f.write(f"{name}\t{artists}\t-\t{uri}\t{release_date}\r\n")
+    os.replace(tmp, args.file)
 
     logging.info("Wrote file: " + args.file)
+    if args.report:
+        metrics.write_report(args.report, format=args.format, dump=args.dump)
+        logging.info("Wrote run report: " + args.report)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except APIError as err:
+        logging.error(f"Giving up, the Spotify API keeps failing: {err}")
+        sys.exit(1)
@@ -0,0 +1,35 @@
+import json
+import os
+
+DEFAULT_SYNC_FILE = "sync_state.json"
+
+
+class SyncState:
+    # Remembers, for every Spotify playlist migrated by --sync, the YouTube Music playlist
+    # it went to, the Spotify snapshot_id it was last synced at and the video chosen for
+    # each of its tracks (None when nothing was found), so later syncs only handle what
+    # changed since.
+    def __init__(self, path=DEFAULT_SYNC_FILE):
+        self.path = path
+        self.playlists = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.playlists = json.load(f)["playlists"]
+
+    def get(self, key):
+        return self.playlists.get(key)
+
+    def update(self, key, playlist_id, snapshot_id, tracks):
+        self.playlists[key] = {
+            "playlist_id": playlist_id,
+            "snapshot_id": snapshot_id,
+            "tracks": tracks,
+        }
+        self.save()
+
+    # Writes to a temporary file first so that an interrupted save can't lose the state.
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"playlists": self.playlists}, f)
+        os.replace(tmp, self.path)
@@ -1,91 +1,266 @@
-import json
 import argparse
-import time
+import itertools
 import logging
-from ytmusicapi import YTMusic, OAuthCredentials
-from dotenv import dotenv_values
-import difflib
+import os
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from search_cache import (
+    CachedYTMusic,
+    SearchCache,
+    DEFAULT_CACHE_FILE,
+    DEFAULT_TTL_DAYS,
+    DEFAULT_MAX_ENTRIES,
+)
+from ratelimit import APIError, CircuitOpenError, Retrier, TokenBucket, is_retryable
+from journal import MigrationJournal, DEFAULT_JOURNAL_FILE
+from scoring import Matcher
+from backup_file import load_playlists
+from sync_state import SyncState, DEFAULT_SYNC_FILE
+from match_store import MatchStore, DEFAULT_MATCH_FILE
+from review import read_review_file, write_review_file
+from metrics import Metrics, Progress
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-env = dotenv_values(".env")
+ADD_BATCH_SIZE = 50
+TIERED_SEARCH_CONFIDENCE = 0.8
+# A song found by searching for a track's ISRC is taken without any further searches if
+# it scores at least this much (or the --tiered-search score, if given) and its duration
+# confirms it.
+ISRC_CONFIDENCE = 0.6
+REVIEW_CONFIDENCE = 0.8
+VIDEO_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
 
 
-def load_playlists(json_file):
-    with open(json_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data["playlists"]
+class LazyYTMusic:
+    # Stands in for a YTMusic client, but only imports ytmusicapi and loads the auth file
+    # when it is first used, so that runs which never reach YouTube Music (all searches
+    # cached, --help, bad arguments) start quickly.
+    def __init__(self, auth):
+        self._auth = auth
+        self._ytmusic = None
+        self._lock = threading.Lock()
 
+    def __getattr__(self, name):
+        with self._lock:
+            if self._ytmusic is None:
+                from ytmusicapi import YTMusic
 
+                self._ytmusic = YTMusic(self._auth)
+        return getattr(self._ytmusic, name)
+
+
+class RetryingYTMusic:
+    # Wraps a YTMusic client so that the calls this script makes go through a shared
+    # Retrier (and the TokenBucket it holds). Errors come out as ratelimit.APIError.
+    def __init__(self, ytmusic, retrier):
+        self._ytmusic = ytmusic
+        self._retrier = retrier
+
+    def search(self, *args, **kwargs):
+        return self._retrier.call("search", self._ytmusic.search, *args, **kwargs)
+
+    def create_playlist(self, *args, **kwargs):
+        return self._retrier.call(
+            "create_playlist", self._ytmusic.create_playlist, *args, **kwargs
+        )
+
+    def add_playlist_items(self, *args, **kwargs):
+        return self._retrier.call(
+            "add_playlist_items", self._ytmusic.add_playlist_items, *args, **kwargs
+        )
+
+    def get_playlist(self, *args, **kwargs):
+        return self._retrier.call("get_playlist", self._ytmusic.get_playlist, *args, **kwargs)
+
+    def remove_playlist_items(self, *args, **kwargs):
+        return self._retrier.call(
+            "remove_playlist_items", self._ytmusic.remove_playlist_items, *args, **kwargs
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._ytmusic, name)
+
+
+# Backups made with spotify-backup.py --slim store artists as plain names.
+def artist_names(track):
+    return [a if isinstance(a, str) else a["name"] for a in track["artists"]]
+
+
+# Full backups have the album as an object and the ISRC in external_ids, --slim backups
+# have the album name and the ISRC on the track itself.
 def spotify_track_to_song(track):
+    album = track.get("album")
     return {
         "title": track["name"],
-        "artists": [artist["name"] for artist in track["artists"]]
+        "artists": artist_names(track),
+        "duration_ms": track.get("duration_ms"),
+        "album": album.get("name") if isinstance(album, dict) else album,
+        "isrc": track.get("isrc") or (track.get("external_ids") or {}).get("isrc"),
     }
 
-def search_song(ytmusic, song, limit=5):
+# Searches songs and videos and returns them all ranked by how well they match, best
+# first. Each result is a copy of the search result with its match "score" added.
+#
+# If the song has an ISRC, it is searched for first, and a confident match there saves
+# the other searches. With a confidence threshold, songs are searched next and videos
+# are only searched if no song scores at least that much (and, when both durations are
+# known, is also close enough in length to confirm it).
+def search_song(ytmusic, song, limit=5, confidence=None):
     query = f"{song['title']} {', '.join(song['artists'])}"
+    matcher = Matcher(song)
+    resultsI = []
+    if song.get("isrc"):
+        resultsI = ytmusic.search(song["isrc"], filter="songs")[:limit]
+        ranked = matcher.rank(resultsI)
+        threshold = ISRC_CONFIDENCE if confidence is None else confidence
+        if ranked and ranked[0][0] >= threshold and matcher.confirms(ranked[0][1]):
+            return [dict(item, score=score) for score, item in ranked]
+
     resultsS = ytmusic.search(query, filter="songs")[:limit]
+    if confidence is not None:
+        ranked = matcher.rank(unique_results(resultsI + resultsS))
+        if ranked and ranked[0][0] >= confidence and matcher.confirms(ranked[0][1]):
+            return [dict(item, score=score) for score, item in ranked]
     resultsV = ytmusic.search(query, filter="videos")[:limit]
-    
-    # Precompute lowercase versions for case-insensitive matching
-    original_title = song['title'].lower()
-    original_artists = ', '.join(song['artists']).lower()
-    
-    # Calculate Jaccard similarity for better partial matching
-    def jaccard_sim(a, b):
-        set_a = set(a.split())
-        set_b = set(b.split())
-        intersection = set_a & set_b
-        union = set_a | set_b
-        return len(intersection) / len(union) if union else 0
-
-    def calculate_similarity(item):
-        if not item:
-            return -1  # Invalid item score
-            
-        title = item['title'].lower()
-        artists = ', '.join([a['name'] for a in item.get('artists', [])]).lower()
-        
-        # Calculate individual similarity components
-        title_sim = jaccard_sim(original_title, title)
-        artist_sim = jaccard_sim(original_artists, artists)
-        full_string_sim = difflib.SequenceMatcher(
-            None, 
-            f"{original_title} {original_artists}",
-            f"{title} {artists}"
-        ).ratio()
-        
-        # Weighted combination (prioritize title and artist matches)
-        return 0.4 * title_sim + 0.4 * artist_sim + 0.2 * full_string_sim
-
-    merged_results = []
-    max_length = max(len(resultsS), len(resultsV))
-    
-    for i in range(max_length):
-        song_item = resultsS[i] if i < len(resultsS) else None
-        video_item = resultsV[i] if i < len(resultsV) else None
-        
-        if song_item and video_item:
-            # Calculate weighted similarity scores
-            song_sim = calculate_similarity(song_item)
-            video_sim = calculate_similarity(video_item)
-            
-            # Place more relevant item first
-            if song_sim >= video_sim:
-                merged_results.append(song_item)
-                merged_results.append(video_item)
-            else:
-                merged_results.append(video_item)
-                merged_results.append(song_item)
-                
-        elif song_item:
-            merged_results.append(song_item)
-        elif video_item:
-            merged_results.append(video_item)
-            
-    return merged_results
+
+    # Interleave so that equally good songs and videos keep their search rank order.
+    candidates = resultsI + [
+        item
+        for pair in itertools.zip_longest(resultsS, resultsV)
+        for item in pair
+        if item
+    ]
+    return [
+        dict(item, score=score) for score, item in matcher.rank(unique_results(candidates))
+    ]
+
+
+# Drops results for a videoId that is already in an earlier result.
+def unique_results(results):
+    seen = set()
+    unique = []
+    for item in results:
+        video_id = item.get("videoId")
+        if video_id and video_id in seen:
+            continue
+        seen.add(video_id)
+        unique.append(item)
+    return unique
+
+
+# Identifies the same Spotify track across playlists. Older backups may lack the uri.
+def track_key(track):
+    return track.get("uri") or f"{track['name']} – {', '.join(artist_names(track))}"
+
+
+def playlist_key(playlist):
+    return playlist.get("id") or playlist["name"]
+
+
+def lookup_song(ytmusic, track, song, resolved=None, confidence=None):
+    if resolved is None:
+        return search_song(ytmusic, song, confidence=confidence)
+    key = track_key(track)
+    if key not in resolved:
+        resolved[key] = search_song(ytmusic, song, confidence=confidence)
+    return resolved[key]
+
+
+# Searches every distinct track in the given playlists exactly once, so that songs that
+# are in Liked Songs and several playlists aren't searched for again in each of them.
+# Returns a dict mapping track_key() to search results, for use with resolve_tracks.
+# Tracks already in known (a dict of the same shape) aren't searched.
+# With live_progress, progress is shown on a single updating line instead of a line
+# every 100 tracks. Searches run on pool, if given (see ordered_map). on_result, if
+# given, is called with the key and results of each track as soon as it has been
+# searched, so that nothing is lost if searching is interrupted.
+def resolve_unique_tracks(
+    ytmusic,
+    playlists,
+    workers=1,
+    known=None,
+    confidence=None,
+    live_progress=False,
+    pool=None,
+    on_result=None,
+):
+    known = known or {}
+    unique = {}
+    total = 0
+    for playlist in playlists:
+        for item in playlist["tracks"]:
+            if item.get("is_local", False) or not item.get("track"):
+                continue
+            total += 1
+            key = track_key(item["track"])
+            if key not in known:
+                unique.setdefault(key, spotify_track_to_song(item["track"]))
+
+    print(f"🔗 Searching {len(unique)} unique tracks ({total} in all playlists)...")
+    resolved = dict(known)
+    songs = unique.values()
+
+    def search(song):
+        return search_song(ytmusic, song, confidence=confidence)
+
+    progress = Progress(len(unique), "Searched", live=live_progress)
+    for key, results in zip(unique, ordered_map(search, songs, workers, pool)):
+        resolved[key] = results
+        if on_result:
+            on_result(key, results)
+        progress.update()
+    progress.close()
+    return resolved
+
+
+# Like map(), but runs fn on up to `workers` threads at once. Results are still
+# yielded in the order of items, and only a bounded number are computed ahead of
+# the consumer. The calls can be submitted to an existing executor, pool, instead of
+# threads of their own; it is shared with others, so it is left running afterwards.
+def ordered_map(fn, items, workers=1, pool=None):
+    if workers <= 1 and pool is None:
+        yield from map(fn, items)
+        return
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= max(1, workers) * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        if own_pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+        else:
+            for future in pending:
+                future.cancel()
+
+
+# Searches for every non-local track, yielding (index, item, song, results) in track
+# order. song and results are None for local tracks.
+# If resolved is given, it maps track_key() to earlier search results; tracks found
+# there aren't searched again, and new results are added to it.
+def resolve_tracks(ytmusic, tracks, workers=1, resolved=None, confidence=None):
+    def resolve(item):
+        if item.get("is_local", False):
+            return None, None
+        song = spotify_track_to_song(item["track"])
+        return song, lookup_song(ytmusic, item["track"], song, resolved, confidence)
+
+    for i, (item, (song, results)) in enumerate(
+        zip(tracks, ordered_map(resolve, tracks, workers))
+    ):
+        yield i, item, song, results
 
 
 def print_results(results):
@@ -98,10 +273,18 @@ def print_results(results):
         else:
             album = album_info.get("name", "Unknown Album")
         duration = r.get("duration", "Unknown")
-        print(f"[{i}] {title} – {artists} | Album: {album} | Duration: {duration}")
+        score = f" | Match: {r['score']:.0%}" if r.get("score") is not None else ""
+        print(f"[{i}] {title} – {artists} | Album: {album} | Duration: {duration}{score}")
 
 
-def interactive_add_tracks(ytmusic, tracks):
+# With a store (a MatchStore), tracks picked by hand before are added without asking,
+# and every song picked is remembered there as a manual choice. Tracks only matched
+# automatically are still asked about, pointing out that match if it is among the results.
+# Tracks that aren't searched because they were decided before are added to resolved as
+# they were decided, so that it has every track for the run report.
+def interactive_add_tracks(
+    ytmusic, tracks, resolved=None, journal=None, confidence=None, store=None
+):
     video_ids = []
     for i, item in enumerate(tracks):
         if item.get("is_local", False):
@@ -109,13 +292,41 @@ def interactive_add_tracks(ytmusic, tracks):
             continue
 
         song = spotify_track_to_song(item["track"])
+        key = track_key(item["track"])
+        if journal and key in journal.resumed:
+            choice = journal.resumed[key]
+            if resolved is not None:
+                resolved.setdefault(key, [choice] if choice else [])
+            if choice and choice.get("videoId"):
+                video_ids.append(choice["videoId"])
+                print(f"♻️ [{i+1}/{len(tracks)}] Previously selected: {choice['title']}")
+            else:
+                print(f"♻️ [{i+1}/{len(tracks)}] Previously skipped: {song['title']}")
+            continue
+
+        match = store.get(key) if store else None
+        if match and match["source"] == "manual":
+            if resolved is not None:
+                resolved.setdefault(key, [match])
+            video_ids.append(match["videoId"])
+            print(f"💾 [{i+1}/{len(tracks)}] Picked before: {match['title']}")
+            if journal:
+                journal.record_track(key, match)
+            continue
+
         print(f"\n🔍 [{i+1}/{len(tracks)}] Searching: {song['title']} – {', '.join(song['artists'])}")
-        results = search_song(ytmusic, song)
+        results = lookup_song(ytmusic, item["track"], song, resolved, confidence)
         if not results:
             print("❌ No results found.")
+            if journal:
+                journal.record_track(key, None)
             continue
 
         print_results(results)
+        for index, result in enumerate(results):
+            if match and result.get("videoId") == match["videoId"]:
+                print(f"💾 [{index}] was matched automatically before")
+                break
         choice = input(
             "Select song number to add to playlist (or press Enter to skip): "
         ).strip()
@@ -126,25 +337,136 @@ def interactive_add_tracks(ytmusic, tracks):
                 if video_id:
                     video_ids.append(video_id)
                     print(f"✅ Selected: {results[index]['title']}")
+                    if journal:
+                        journal.record_track(key, results[index])
+                    if store:
+                        store.put(key, results[index], "manual")
                 else:
                     print("⚠️ No videoId found.")
             else:
                 print("⚠️ Invalid choice.")
         else:
             print("⏭ Skipped.")
+            if journal:
+                journal.record_track(key, None)
     return video_ids
 
 
-def auto_add_tracks(ytmusic, tracks):
-    video_ids = []
-    for i, item in enumerate(tracks):
-        if item.get("is_local", False):
+def auto_add_tracks(ytmusic, tracks, workers=1, resolved=None, journal=None, confidence=None):
+    return list(auto_select_tracks(ytmusic, tracks, workers, resolved, journal, confidence))
+
+
+# Returns the result picked by a review answer: the number of one of the results, or
+# any other videoId. Nothing skips the track (None), and anything else raises a
+# ValueError.
+def pick_result(results, answer):
+    answer = answer.strip()
+    if not answer:
+        return None
+    if answer.isdigit() and int(answer) < len(results):
+        return results[int(answer)]
+    for result in results:
+        if result.get("videoId") == answer:
+            return result
+    if VIDEO_ID.match(answer):
+        return {"videoId": answer, "title": answer, "artists": []}
+    if answer.isdigit():
+        raise ValueError(f"there is no option {answer}")
+    raise ValueError(f"{answer!r} is neither an option number nor a videoId")
+
+
+# Accepts the best match of every track in playlists that scores at least confidence,
+# and has the rest reviewed in one go after all searching is done: here, or with
+# review_file, in a CSV or JSON file edited offline. A review file that doesn't exist
+# yet is written with the tracks to review and None is returned, so that the run can
+# stop until it has been filled in. Otherwise returns a copy of resolved in which every
+# reviewed track has only its chosen result (or none if skipped). If the review file has
+# invalid choices or is missing tracks to review, they are reported, missing tracks are
+# added to it, and None is returned too. Tracks in known were
+# decided before and aren't reviewed again. Both accepted and reviewed matches are
+# remembered in store.
+def review_tracks(playlists, resolved, known, confidence, review_file=None, store=None):
+    songs = {}
+    for playlist in playlists:
+        for item in playlist["tracks"]:
+            if item.get("track") and not item.get("is_local", False):
+                key = track_key(item["track"])
+                if key not in known:
+                    songs.setdefault(key, spotify_track_to_song(item["track"]))
+    pending = [
+        (key, song, resolved[key])
+        for key, song in songs.items()
+        if resolved[key] and (resolved[key][0].get("score") or 0) < confidence
+    ]
+    not_found = sum(1 for key in songs if not resolved[key])
+    print(
+        f"🧐 Accepted {len(songs) - len(pending) - not_found} confident matches, "
+        f"{len(pending)} to review, {not_found} not found"
+    )
+    if store:
+        remember_matches(store, resolved, known.keys() | {key for key, _, _ in pending})
+
+    answers = None
+    if review_file:
+        if not os.path.exists(review_file):
+            write_review_file(review_file, pending)
+            print(f"📝 Wrote {review_file}. Fill in the choices and run again to continue.")
+            return None
+        answers = read_review_file(review_file)
+        invalid = 0
+        for key, song, results in pending:
+            try:
+                pick_result(results, answers.get(key, ""))
+            except ValueError as e:
+                print(f"⚠️ Invalid choice for {song['title']} ({key}): {e}")
+                invalid += 1
+        missing = sum(1 for key, _, _ in pending if key not in answers)
+        if missing:
+            # Tracks that weren't there when the file was written, e.g. from a newer
+            # backup, are added to it with the choices made so far.
+            write_review_file(review_file, pending, answers)
+            print(f"⚠️ {missing} tracks to review weren't in {review_file}, added them")
+        if invalid or missing:
+            print(f"📝 Fill in or fix the choices in {review_file} and run again.")
+            return None
+
+    reviewed = dict(resolved)
+    for i, (key, song, results) in enumerate(pending):
+        if answers is not None:
+            choice = pick_result(results, answers.get(key, ""))
+        else:
+            print(f"\n🔍 [{i+1}/{len(pending)}] {song['title']} – {', '.join(song['artists'])}")
+            print_results(results)
+            while True:
+                answer = input(
+                    "Select song number or paste a videoId (or press Enter to skip): "
+                )
+                try:
+                    choice = pick_result(results, answer)
+                    break
+                except ValueError as e:
+                    print(f"⚠️ Invalid choice: {e}")
+        reviewed[key] = [choice] if choice else []
+        if choice and store:
+            store.put(key, choice, "manual")
+    return reviewed
+
+
+# Like auto_add_tracks, but yields each video id as soon as its track is resolved.
+def auto_select_tracks(
+    ytmusic, tracks, workers=1, resolved=None, journal=None, confidence=None
+):
+    for i, item, song, results in resolve_tracks(
+        ytmusic, tracks, workers, resolved, confidence
+    ):
+        if song is None:
             print(f"⏭ Skipping local track: {item['track']['name']}")
             continue
 
-        song = spotify_track_to_song(item["track"])
         print(f"\n🔍 [{i+1}/{len(tracks)}] Searching: {song['title']} – {', '.join(song['artists'])}")
-        results = search_song(ytmusic, song)
+        key = track_key(item["track"])
+        if journal and key not in journal.choices:
+            journal.record_track(key, results[0] if results else None)
         if not results:
             print("❌ No results found.")
             continue
@@ -152,75 +474,482 @@ def auto_add_tracks(ytmusic, tracks):
         first = results[0]
         video_id = first.get("videoId")
         if video_id:
-            video_ids.append(video_id)
             title = first.get("title")
             artists = ", ".join([a["name"] for a in first.get("artists", [])])
             print(f"✅ Auto-selected: {title} – {artists}")
+            yield video_id
         else:
             print("⚠️ First result has no videoId.")
-    return video_ids
 
 
-def dry_run_tracks(ytmusic, tracks):
-    for i, item in enumerate(tracks):
-        if item.get("is_local", False):
+def dry_run_tracks(ytmusic, tracks, workers=1, resolved=None, confidence=None):
+    for i, item, song, results in resolve_tracks(
+        ytmusic, tracks, workers, resolved, confidence
+    ):
+        if song is None:
             print(f"⏭ Skipping local track: {item['track']['name']}")
             continue
 
-        song = spotify_track_to_song(item["track"])
         print(f"\n🔍 [{i+1}/{len(tracks)}] {song['title']} – {', '.join(song['artists'])}")
-        results = search_song(ytmusic, song)
         if not results:
             print("❌ No results found.")
             continue
         print_results(results)
 
 
-def create_yt_playlist(ytmusic, name, description, video_ids):
-    playlist_name = f"{name} (Spotify import)"
+# With a journal, the playlist's creation and every added batch are recorded under
+# key, and a playlist left unfinished by an earlier run is continued instead of being
+# created again.
+def create_yt_playlist(
+    ytmusic, name, description, video_ids, batch_size=ADD_BATCH_SIZE, journal=None, key=None
+):
     total_songs = len(video_ids)
+    playlist_id, skip = open_yt_playlist(ytmusic, name, description, journal, key)
+    if not playlist_id:
+        return None
     
+    if not video_ids:
+        print("⚠️ No songs to add to playlist")
+        return playlist_id
+
+    on_batch = None
+    if journal:
+        retry_failed_songs(ytmusic, playlist_id, batch_size, journal, key)
+        on_batch = lambda batch, results: journal.record_added(
+            key, len(batch), failed_ids(batch, results)
+        )
+    total_added = sum(
+        add_songs(ytmusic, playlist_id, video_ids[skip:], batch_size, on_batch)
+    )
+    
+    print(f"Total songs added: {total_added}/{total_songs - skip}")
+    return playlist_id
+
+
+# Creates an empty playlist, or finds the one an earlier run recorded in the journal
+# under key. Returns its id (None if it couldn't be created) and the number of songs
+# that were already added to it.
+def open_yt_playlist(ytmusic, name, description, journal=None, key=None):
+    state = journal.playlists.get(key, {}) if journal else {}
+    playlist_id = state.get("playlist_id")
+    skip = state.get("added", 0)
+
+    if playlist_id:
+        print(f"♻️ Continuing playlist {playlist_id} after {skip} songs")
+        return playlist_id, skip
     try:
         print("Creating empty playlist...")
         playlist_id = ytmusic.create_playlist(
-            playlist_name, description, privacy_status="PRIVATE"
+            f"{name} (Spotify import)", description, privacy_status="PRIVATE"
         )
         print(f"✅ Created empty playlist: {playlist_id}")
     except Exception as e:
         print(f"❌ Failed to create empty playlist: {e}")
-        return None
-    
-    if not video_ids:
-        print("⚠️ No songs to add to playlist")
-        return playlist_id
-    
-    total_added = add_individual_songs(ytmusic, playlist_id, video_ids)
-    
-    print(f"Total songs added: {total_added}/{total_songs}")
-    return playlist_id
+        return None, 0
+    if journal:
+        journal.record_created(key, playlist_id)
+    return playlist_id, 0
+
+
+# Songs that an earlier run, recorded in journal under key, couldn't add to the playlist
+# are sent again.
+def retry_failed_songs(ytmusic, playlist_id, batch_size, journal, key):
+    failed = list(journal.playlists.get(key, {}).get("failed", []))
+    if not failed:
+        return
+    print(f"♻️ Trying again to add {len(failed)} songs that couldn't be added before")
+    add_songs(
+        ytmusic,
+        playlist_id,
+        failed,
+        batch_size,
+        lambda batch, results: journal.record_retried(
+            key, batch, failed_ids(batch, results)
+        ),
+    )
+
+
+def failed_ids(video_ids, results):
+    return [video_id for video_id, added in zip(video_ids, results) if not added]
+
+
+# Adds songs to a playlist in chunks of batch_size and returns a success flag for each
+# video id, in the same order as video_ids. on_batch is called with each chunk and its
+# flags once it has been sent. If YouTube Music keeps failing (see add_batch), on_batch
+# is called with the part of the chunk that was sent before the error is raised.
+def add_songs(ytmusic, playlist_id, video_ids, batch_size=ADD_BATCH_SIZE, on_batch=None):
+    results = []
+    for start in range(0, len(video_ids), batch_size):
+        batch = video_ids[start:start + batch_size]
+        try:
+            batch_results = add_batch(ytmusic, playlist_id, batch)
+        except APIError as e:
+            if on_batch and e.added:
+                on_batch(batch[:len(e.added)], e.added)
+            raise
+        results += batch_results
+        if on_batch:
+            on_batch(batch, batch_results)
+        print(
+            f"✅ Added {sum(batch_results)}/{len(batch)} songs "
+            f"({start + 1}-{start + len(batch)} of {len(video_ids)})"
+        )
+
+    print(f"Added {sum(results)}/{len(video_ids)} songs")
+    return results
+
+
+# add_playlist_items() returns YouTube Music's raw response, a dialog asking whether to
+# add them anyway, instead of a status when songs are already in the playlist.
+def is_duplicate_response(response):
+    return isinstance(response, dict) and "confirmDialogEndpoint" in str(response.get("actions"))
+
+
+# Adds a chunk of songs in a single request and returns a success flag per video id.
+# If the request is rejected the chunk is split in half and each half is tried again, so
+# that a bad id only costs a few extra requests instead of failing its whole chunk.
+#
+# Transient errors are already retried by RetryingYTMusic, and splitting the chunk
+# wouldn't help with them, so if one still comes out of it (or the circuit is open) it
+# is raised. Its `added` attribute has the flags of the ids before the chunk's part that
+# failed, which had already been sent.
+#
+# YouTube Music rejects the whole chunk if any of it is already in the playlist, so ids
+# that appear twice (the same song twice, or two tracks matched to one video) are only
+# sent once, and a single id that is already there counts as added.
+def add_batch(ytmusic, playlist_id, video_ids):
+    unique = list(dict.fromkeys(video_ids))
+    if len(unique) < len(video_ids):
+        try:
+            flags = dict(zip(unique, add_batch(ytmusic, playlist_id, unique)))
+        except APIError as e:
+            flags = dict(zip(unique, e.added))
+            e.added = [flags[v] for v in itertools.takewhile(flags.__contains__, video_ids)]
+            raise
+        return [flags[v] for v in video_ids]
+
+    try:
+        response = ytmusic.add_playlist_items(playlist_id, video_ids)
+        if isinstance(response, dict) and "SUCCEEDED" in str(response.get("status")):
+            return [True] * len(video_ids)
+        if len(video_ids) == 1 and is_duplicate_response(response):
+            return [True]
+        error = f"unexpected response {response}"
+    except Exception as e:
+        if is_transient(e):
+            e.added = []
+            raise
+        error = str(e)
+
+    if len(video_ids) == 1:
+        print(f"❌ Failed to add song {video_ids[0]}: {error}")
+        return [False]
+
+    middle = len(video_ids) // 2
+    first = add_batch(ytmusic, playlist_id, video_ids[:middle])
+    try:
+        return first + add_batch(ytmusic, playlist_id, video_ids[middle:])
+    except APIError as e:
+        e.added = first + e.added
+        raise
+
+
+# Returns True for an error that RetryingYTMusic gave up on even though it could
+# succeed later: its circuit is open, or it ran out of tries on server errors.
+def is_transient(err):
+    if isinstance(err, CircuitOpenError):
+        return True
+    return isinstance(err, APIError) and is_retryable(err.cause)
+
 
+class PlaylistWriter:
+    # Creates playlists and adds songs to them on a background thread, so that searching
+    # for the next songs doesn't wait for earlier ones to be added. Playlists and songs
+    # are sent through a bounded queue: start_playlist(), add() for each video id in
+    # order, then end_playlist(). Songs are added in batches of batch_size as they come
+    # in, and a playlist is only created once it has a first song.
+    #
+    # With a journal, everything is recorded the same way as by create_yt_playlist, so
+    # an interrupted run can be resumed either way. If YouTube Music keeps failing (see
+    # add_batch), nothing more is written and the error is kept in `error`.
+    def __init__(self, ytmusic, batch_size=ADD_BATCH_SIZE, journal=None, queue_size=None):
+        self.ytmusic = ytmusic
+        self.batch_size = batch_size
+        self.journal = journal
+        self.error = None
+        self._queue = queue.Queue(queue_size or batch_size * 4)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
 
-def add_individual_songs(ytmusic, playlist_id, video_ids):
-    added = 0
-    for video_id in video_ids:
-        success = False
-        for attempt in range(1, 4):
+    def start_playlist(self, key, name, description):
+        self._queue.put(("start", key, name, description))
+
+    def add(self, video_id):
+        self._queue.put(("add", video_id))
+
+    def end_playlist(self):
+        self._queue.put(("end",))
+
+    # Waits for everything queued to be written.
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    # Stops after the request in flight, dropping whatever is still queued.
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
             try:
-                response = ytmusic.add_playlist_items(playlist_id, [video_id])
-                added += 1
-                success = True
-                print(f"✅ Added song: {video_id} (attempt {attempt})")
-                break
+                message = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if message is None:
+                return
+            kind, *values = message
+            if self.error:
+                continue
+            try:
+                if kind == "start":
+                    self._start(*values)
+                elif kind == "add":
+                    self._add(*values)
+                else:
+                    self._end()
             except Exception as e:
-                print(f"⚠️ Exception adding {video_id} (attempt {attempt}): {str(e)}")
-            
-            time.sleep(0.5)
-        
-        if not success:
-            print(f"❌ Failed to add song after 3 attempts: {video_id}")
-    
-    print(f"Added {added}/{len(video_ids)} songs")
-    return added
+                if is_transient(e):
+                    print(f"❌ Giving up on writing playlists: {e}")
+                    self.error = e
+                    continue
+                # Keep draining the queue so the searching side is never left blocked.
+                print(f"❌ Failed to write playlist '{self.name}': {e}")
+                self.failed = True
+
+    def _start(self, key, name, description):
+        self.key, self.name, self.description = key, name, description
+        self.playlist_id = None
+        self.failed = False
+        self.skip = 0
+        self.count = 0
+        self.batch = []
+
+    def _add(self, video_id):
+        self.count += 1
+        if self.failed:
+            return
+        if not self.playlist_id:
+            self.playlist_id, self.skip = open_yt_playlist(
+                self.ytmusic, self.name, self.description, self.journal, self.key
+            )
+            self.failed = not self.playlist_id
+            if self.failed:
+                print(f"❌ Failed to create playlist '{self.name}'")
+                return
+            if self.journal:
+                retry_failed_songs(
+                    self.ytmusic, self.playlist_id, self.batch_size, self.journal, self.key
+                )
+        # Songs an earlier run already added come first again; don't add them twice.
+        if self.count > self.skip:
+            self.batch.append(video_id)
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.batch:
+            return
+        try:
+            results = add_batch(self.ytmusic, self.playlist_id, self.batch)
+        except APIError as e:
+            if self.journal and e.added:
+                sent = self.batch[:len(e.added)]
+                self.journal.record_added(self.key, len(sent), failed_ids(sent, e.added))
+            raise
+        if self.journal:
+            self.journal.record_added(
+                self.key, len(self.batch), failed_ids(self.batch, results)
+            )
+        print(f"✅ Added {sum(results)}/{len(self.batch)} songs to '{self.name}'")
+        self.batch = []
+
+    def _end(self):
+        if self.failed:
+            return
+        if self.playlist_id:
+            self._flush()
+            print(f"✅ Successfully created playlist '{self.name}'")
+            verify_playlist(self.ytmusic, self.playlist_id, self.count)
+        else:
+            print(f"⏭ No valid songs found for '{self.name}', skipping playlist creation")
+        if self.journal:
+            self.journal.record_done(self.key)
+
+
+def verify_playlist(ytmusic, playlist_id, expected):
+    try:
+        playlist_details = ytmusic.get_playlist(playlist_id)
+        actual_count = playlist_details.get('trackCount', 'unknown')
+        print(f"🔍 Playlist verification: Expected {expected} songs, actual: {actual_count}")
+    except Exception as e:
+        print(f"⚠️ Failed to verify playlist: {e}")
+
+
+def migrate_playlist(ytmusic, playlist, args, resolved, journal, store=None):
+    name = playlist["name"]
+    description = playlist.get("description", "")
+    tracks = playlist["tracks"]
+    key = playlist_key(playlist)
+
+    print(f"\n📝 Processing playlist: {name}")
+    print(f"   Description: {description}")
+    print(f"   Number of tracks: {len(tracks)}")
+
+    if args.add:
+        video_ids = interactive_add_tracks(
+            ytmusic, tracks, resolved, journal, args.tiered_search, store
+        )
+    else:
+        video_ids = auto_add_tracks(ytmusic, tracks, resolved=resolved, journal=journal)
+
+    if video_ids:
+        print(f"\n📦 Creating playlist with {len(video_ids)} songs...")
+        playlist_id = create_yt_playlist(
+            ytmusic, name, description, video_ids, args.batch_size, journal, key
+        )
+        if playlist_id:
+            print(f"✅ Successfully created playlist '{name}'")
+            verify_playlist(ytmusic, playlist_id, len(video_ids))
+            journal.record_done(key)
+        else:
+            print(f"❌ Failed to create playlist '{name}'")
+    else:
+        print("⏭ No valid songs found, skipping playlist creation")
+        journal.record_done(key)
+
+
+# Like migrate_playlist with --auto-add, but the playlist is written by writer (a
+# PlaylistWriter) while its tracks are still being searched for.
+def pipeline_playlist(ytmusic, playlist, args, resolved, journal, writer):
+    name = playlist["name"]
+    description = playlist.get("description", "")
+    tracks = playlist["tracks"]
+
+    print(f"\n📝 Processing playlist: {name}")
+    print(f"   Description: {description}")
+    print(f"   Number of tracks: {len(tracks)}")
+
+    writer.start_playlist(playlist_key(playlist), name, description)
+    for video_id in auto_select_tracks(
+        ytmusic, tracks, args.workers, resolved, journal, args.tiered_search
+    ):
+        writer.add(video_id)
+    writer.end_playlist()
+
+
+# Remembers the best match of every track that was searched for, i.e. isn't in known,
+# in store as an automatic choice.
+def remember_matches(store, resolved, known):
+    store.put_many(
+        (key, results[0])
+        for key, results in resolved.items()
+        if results and key not in known
+    )
+
+
+# Returns the Spotify tracks of a playlist that can be migrated, keyed by track_key(),
+# in playlist order. A track that is in the playlist twice is only kept once.
+def syncable_tracks(playlist):
+    return {
+        track_key(item["track"]): item["track"]
+        for item in playlist["tracks"]
+        if item.get("track") and not item.get("is_local", False)
+    }
+
+
+def first_video_id(results):
+    return results[0].get("videoId") if results else None
+
+
+# Brings the YouTube Music playlist of an earlier --sync up to date with the Spotify
+# playlist: songs for new tracks are added and songs of removed tracks are removed.
+# Playlists whose snapshot_id hasn't changed are skipped, and playlists that weren't
+# synced before are created.
+def sync_playlist(ytmusic, playlist, state, resolved, batch_size=ADD_BATCH_SIZE):
+    name = playlist["name"]
+    key = playlist_key(playlist)
+    snapshot_id = playlist.get("snapshot_id")
+    entry = state.get(key)
+    if entry and snapshot_id and entry["snapshot_id"] == snapshot_id:
+        print(f"⏭ Unchanged since last sync: {name}")
+        return
+
+    current = syncable_tracks(playlist)
+    new = entry is None
+    if new:
+        print(f"\n📝 New playlist: {name} ({len(current)} tracks)")
+        playlist_id, _ = open_yt_playlist(ytmusic, name, playlist.get("description", ""))
+        if not playlist_id:
+            return
+        # Saved right away, without a snapshot, so that a sync that fails halfway
+        # continues this playlist instead of creating another one.
+        entry = {"playlist_id": playlist_id, "snapshot_id": None, "tracks": {}}
+        state.update(key, playlist_id, None, {})
+
+    playlist_id = entry["playlist_id"]
+    videos = dict(entry["tracks"])
+    added = [k for k in current if k not in videos]
+    removed = [k for k in videos if k not in current]
+    if not new:
+        print(f"\n📝 Syncing playlist: {name} (+{len(added)} / -{len(removed)} tracks)")
+
+    new_ids = {k: first_video_id(resolved[k]) for k in added}
+    for k in added:
+        if not new_ids[k]:
+            videos[k] = None
+    to_add = [k for k in added if new_ids[k]]
+    sent = 0
+
+    # Songs are saved after every batch, under the old snapshot, so that whatever
+    # happens next they aren't added twice. Songs that couldn't be added are left out of
+    # the state, so the next sync tries them again.
+    def on_batch(batch, results):
+        nonlocal sent
+        for k, ok in zip(to_add[sent:sent + len(batch)], results):
+            if ok:
+                videos[k] = new_ids[k]
+        sent += len(batch)
+        state.update(key, playlist_id, entry["snapshot_id"], videos)
+
+    results = []
+    if to_add:
+        results = add_songs(
+            ytmusic, playlist_id, [new_ids[k] for k in to_add], batch_size, on_batch
+        )
+    if not all(results):
+        snapshot_id = entry["snapshot_id"]
+
+    removed_videos = {k: videos.pop(k) for k in removed}
+    # A video that another track of the playlist still uses has to stay.
+    removed_ids = set(removed_videos.values()) - set(videos.values()) - {None}
+    # Removing needs the setVideoId of each item, which only the playlist itself has.
+    if removed_ids:
+        try:
+            items = ytmusic.get_playlist(playlist_id, limit=None)["tracks"]
+            ytmusic.remove_playlist_items(
+                playlist_id, [t for t in items if t.get("videoId") in removed_ids]
+            )
+            print(f"🗑 Removed {len(removed_ids)} songs")
+        except Exception as e:
+            print(f"⚠️ Failed to remove songs: {e}")
+            # The removed tracks and the old snapshot are kept so that the next sync
+            # removes them again.
+            videos.update(removed_videos)
+            snapshot_id = entry["snapshot_id"]
+
+    state.update(key, playlist_id, snapshot_id, videos)
 
 
 if __name__ == "__main__":
@@ -233,11 +962,38 @@ if __name__ == "__main__":
         action="store_true",
         help="Automatically create playlists using first search results.",
     )
+    parser.add_argument(
+        "--review",
+        type=float,
+        nargs="?",
+        const=REVIEW_CONFIDENCE,
+        metavar="SCORE",
+        help="Search all tracks first, automatically add those whose best match scores "
+        f"at least SCORE (0-1, default: {REVIEW_CONFIDENCE}) and then ask only about "
+        "the rest, all in one go.",
+    )
+    parser.add_argument(
+        "--review-file",
+        metavar="FILE",
+        help="With --review, write the tracks to review to a .csv or .json file to fill "
+        "in offline, or read the choices from it if it exists.",
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
         help="Only search and show results without creating playlists.",
     )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Like --auto-add, but update the playlists of earlier syncs with only "
+        "the tracks added or removed since.",
+    )
+    parser.add_argument(
+        "--sync-state",
+        default=DEFAULT_SYNC_FILE,
+        help=f"File mapping synced Spotify playlists to YouTube Music (default: {DEFAULT_SYNC_FILE})",
+    )
     parser.add_argument(
         "--file",
         default="playlists.json",
@@ -245,49 +1001,257 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--auth",
-        default="headers_auth.json",
-        help="Path to YTMusic auth headers (default: headers_auth.json)",
+        default="browser.json",
+        help="Path to YTMusic auth headers (default: browser.json)",
+    )
+    parser.add_argument(
+        "--cache",
+        default=DEFAULT_CACHE_FILE,
+        help=f"SQLite file used to cache search results (default: {DEFAULT_CACHE_FILE})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write the search result cache.",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Ignore cached search results and songs matched automatically before, and "
+        "overwrite them with fresh ones.",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_TTL_DAYS,
+        help=f"Days before a cached search result expires (default: {DEFAULT_TTL_DAYS})",
+    )
+    parser.add_argument(
+        "--cache-max-entries",
+        type=int,
+        default=DEFAULT_MAX_ENTRIES,
+        help=f"Maximum number of cached searches to keep (default: {DEFAULT_MAX_ENTRIES})",
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of searches to run concurrently in --auto-add and --dry-run (default: 1)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=5.0,
+        help="Maximum YouTube Music searches per second (default: 5)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=ADD_BATCH_SIZE,
+        help=f"Number of songs added to a playlist per request (default: {ADD_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="With --auto-add, add songs to each playlist while the rest are still "
+        "being searched for.",
+    )
+    parser.add_argument(
+        "--journal",
+        default=DEFAULT_JOURNAL_FILE,
+        help=f"File recording the progress of --add/--auto-add (default: {DEFAULT_JOURNAL_FILE})",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted --add/--auto-add run from its journal.",
+    )
+    parser.add_argument(
+        "--matches",
+        default=DEFAULT_MATCH_FILE,
+        help="SQLite file remembering the song chosen for each track "
+        f"(default: {DEFAULT_MATCH_FILE})",
+    )
+    parser.add_argument(
+        "--no-matches",
+        action="store_true",
+        help="Don't use or remember earlier matches.",
+    )
+    parser.add_argument(
+        "--export-matches",
+        metavar="FILE",
+        help="Write the remembered matches to a JSON file.",
+    )
+    parser.add_argument(
+        "--import-matches",
+        metavar="FILE",
+        help="Merge matches from a JSON file written by --export-matches. Manual "
+        "choices win over automatic ones, otherwise the newest wins.",
+    )
+    parser.add_argument(
+        "--tiered-search",
+        type=float,
+        nargs="?",
+        const=TIERED_SEARCH_CONFIDENCE,
+        metavar="SCORE",
+        help="Only search videos when no song result scores at least SCORE "
+        f"(0-1, default when given without a value: {TIERED_SEARCH_CONFIDENCE}).",
+    )
 
-    ytmusic = YTMusic(
-        "browser.json"
+    parser.add_argument(
+        "--report",
+        metavar="FILE",
+        help="Write a JSON report of the run: timings, API calls, retries, cache hits "
+        "and match rate.",
     )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="Show searching progress with an ETA on a single updating line.",
+    )
+
+    args = parser.parse_args()
+    mode = args.add or args.auto_add or args.review is not None or args.dry_run or args.sync
+    if not (mode or args.import_matches or args.export_matches):
+        parser.error("please specify --add, --auto-add, --review, --sync or --dry-run")
+    if args.review is not None and (args.add or args.auto_add):
+        parser.error("--review can't be used with --add or --auto-add")
+    if args.no_matches and (args.import_matches or args.export_matches):
+        parser.error("--import-matches and --export-matches can't be used with --no-matches")
+
+    store = None
+    if not args.no_matches:
+        store = MatchStore(args.matches)
+        if args.import_matches:
+            count = store.import_json(args.import_matches)
+            print(f"📥 Imported {count} matches from {args.import_matches}")
+        if args.export_matches:
+            count = store.export_json(args.export_matches)
+            print(f"📤 Exported {count} matches to {args.export_matches}")
+    if not mode:
+        store.close()
+        raise SystemExit()
+    metrics = Metrics()
+    ytmusic = LazyYTMusic(args.auth)
+    limiter = TokenBucket(args.rate, burst=max(2, args.workers))
+    ytmusic = RetryingYTMusic(ytmusic, Retrier(limiter=limiter, metrics=metrics))
+    cache = None
+    if not args.no_cache:
+        cache = SearchCache(
+            args.cache,
+            ttl=args.cache_ttl * 86400,
+            max_entries=args.cache_max_entries,
+            refresh=args.refresh_cache,
+        )
+        ytmusic = CachedYTMusic(ytmusic, cache)
     playlists = load_playlists(args.file)
+    resolved = {}
 
-    if args.add or args.auto_add:
+    # Tracks matched in earlier runs are used as they were chosen then, except for
+    # automatic matches with --refresh-cache.
+    remembered = {}
+    if store:
+        matches = store.matches()
         for playlist in playlists:
-            name = playlist["name"]
-            description = playlist.get("description", "")
-            tracks = playlist["tracks"]
-            
-            print(f"\n📝 Processing playlist: {name}")
-            print(f"   Description: {description}")
-            print(f"   Number of tracks: {len(tracks)}")
-            
-            if args.add:
-                video_ids = interactive_add_tracks(ytmusic, tracks)
-            else:
-                video_ids = auto_add_tracks(ytmusic, tracks)
-            
-            if video_ids:
-                print(f"\n📦 Creating playlist with {len(video_ids)} songs...")
-                playlist_id = create_yt_playlist(ytmusic, name, description, video_ids)
-                if playlist_id:
-                    print(f"✅ Successfully created playlist '{name}'")
-                    try:
-                        playlist_details = ytmusic.get_playlist(playlist_id)
-                        actual_count = playlist_details.get('trackCount', 'unknown')
-                        print(f"🔍 Playlist verification: Expected {len(video_ids)} songs, actual: {actual_count}")
-                    except Exception as e:
-                        print(f"⚠️ Failed to verify playlist: {e}")
-                else:
-                    print(f"❌ Failed to create playlist '{name}'")
+            for item in playlist["tracks"]:
+                key = track_key(item["track"]) if item.get("track") else None
+                match = matches.get(key)
+                if match and not (args.refresh_cache and match["source"] == "auto"):
+                    remembered[key] = [match]
+
+    if args.add or args.auto_add or args.review is not None:
+        journal = MigrationJournal(args.journal, resume=args.resume)
+
+        # Playlists may be streamed from disk, so they are filtered lazily on every pass.
+        def pending():
+            return (p for p in playlists if not journal.is_done(playlist_key(p)))
+
+        # Tracks resolved by an earlier run are reused as they were chosen then, except
+        # that --review also asks about automatic matches that aren't confident enough.
+        known = dict(remembered)
+        if args.review is not None:
+            known = {
+                key: [match]
+                for key, [match] in known.items()
+                if match["source"] == "manual" or (match.get("score") or 0) >= args.review
+            }
+        known.update(
+            (key, [choice] if choice else []) for key, choice in journal.choices.items()
+        )
+
+        # Every search is journaled right away, except for matches still to be reviewed.
+        def searched(key, results):
+            resolved[key] = results
+            best = results[0] if results else None
+            if args.review is None or not best or (best.get("score") or 0) >= args.review:
+                journal.record_track(key, best)
+
+        writer = None
+        try:
+            # Interactive mode and the pipeline search as they go, but still only once
+            # per distinct track.
+            if args.auto_add and args.pipeline:
+                resolved = known
+            elif args.auto_add or args.review is not None:
+                resolved = dict(known)
+                with metrics.phase("search"):
+                    resolve_unique_tracks(
+                        ytmusic,
+                        pending(),
+                        args.workers,
+                        known,
+                        args.tiered_search,
+                        args.progress,
+                        on_result=searched,
+                    )
+
+            chosen = resolved
+            if args.review is not None:
+                with metrics.phase("review"):
+                    chosen = review_tracks(
+                        pending(), resolved, known, args.review, args.review_file, store
+                    )
+            if chosen is None:
+                # The review file is waiting to be filled in or corrected.
+                pass
+            elif args.auto_add and args.pipeline:
+                writer = PlaylistWriter(ytmusic, args.batch_size, journal)
+                with metrics.phase("pipeline"):
+                    for playlist in pending():
+                        pipeline_playlist(ytmusic, playlist, args, chosen, journal, writer)
+                    writer.close()
+                if writer.error:
+                    raise writer.error
             else:
-                print("⏭ No valid songs found, skipping playlist creation")
+                with metrics.phase("playlists"):
+                    for playlist in pending():
+                        migrate_playlist(ytmusic, playlist, args, chosen, journal, store)
+        except KeyboardInterrupt:
+            print(f"\n⏹ Interrupted. Run again with --resume to continue from {args.journal}")
+        except APIError as e:
+            if not is_transient(e):
+                raise
+            print(f"\n❌ Giving up: {e}")
+            print(f"Run again later with --resume to continue from {args.journal}")
+        finally:
+            if writer:
+                writer.stop()
+            journal.close()
+            # Interactive and reviewed choices are remembered as they are made.
+            if store and args.auto_add:
+                remember_matches(store, resolved, known)
 
     elif args.dry_run:
+        with metrics.phase("search"):
+            resolved = resolve_unique_tracks(
+                ytmusic,
+                playlists,
+                args.workers,
+                remembered,
+                confidence=args.tiered_search,
+                live_progress=args.progress,
+            )
         for playlist in playlists:
             name = playlist["name"]
             description = playlist.get("description", "")
@@ -297,7 +1261,57 @@ if __name__ == "__main__":
             print(f"   Description: {description}")
             print(f"   Number of tracks: {len(tracks)}")
             
-            dry_run_tracks(ytmusic, tracks)
+            dry_run_tracks(ytmusic, tracks, resolved=resolved)
 
-    else:
-        print("❌ Please specify --add, --auto-add, or --dry-run")
\ No newline at end of file
+    elif args.sync:
+        state = SyncState(args.sync_state)
+
+        def changed():
+            for playlist in playlists:
+                entry = state.get(playlist_key(playlist))
+                snapshot_id = playlist.get("snapshot_id")
+                if not (entry and snapshot_id and entry["snapshot_id"] == snapshot_id):
+                    yield playlist
+
+        # Tracks synced before keep their video, so only new tracks are searched.
+        known = dict(remembered)
+        for entry in state.playlists.values():
+            for k, video_id in entry["tracks"].items():
+                known[k] = [{"videoId": video_id}] if video_id else []
+        try:
+            with metrics.phase("search"):
+                resolved = resolve_unique_tracks(
+                    ytmusic, changed(), args.workers, known, args.tiered_search, args.progress
+                )
+            with metrics.phase("playlists"):
+                for playlist in playlists:
+                    sync_playlist(ytmusic, playlist, state, resolved, args.batch_size)
+        except KeyboardInterrupt:
+            print("\n⏹ Interrupted. Run --sync again to continue.")
+        except APIError as e:
+            if not is_transient(e):
+                raise
+            print(f"\n❌ Giving up: {e}")
+            print("Run --sync again later to continue.")
+        finally:
+            if store:
+                remember_matches(store, resolved, known)
+
+    if cache:
+        print(f"\n🗄 Search cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+    if store:
+        store.close()
+
+    if args.report:
+        matched = sum(1 for results in resolved.values() if results)
+        metrics.write_report(
+            args.report,
+            tracks={
+                "unique": len(resolved),
+                "matched": matched,
+                "match_rate": round(matched / len(resolved), 3) if resolved else None,
+            },
+            cache={"hits": cache.hits, "misses": cache.misses} if cache else None,
+        )
+        print(f"📊 Wrote run report: {args.report}")